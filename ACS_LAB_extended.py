@@ -2,11 +2,10 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from oauth2client.service_account import ServiceAccountCredentials
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from shutil import which
 from datetime import datetime
-import gspread
+from sheets_common import authorize, cached_credentials, write_cells, call_budget, print_call_budget
 from zoneinfo import ZoneInfo
 
 # === CONFIG ===
@@ -20,8 +19,8 @@ BATCH_SIZE = THREADS
 
 # === Google Sheets Setup ===
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIAL_FILE, scope)
-client = gspread.authorize(creds)
+creds = cached_credentials(CREDENTIAL_FILE, scope)
+client = authorize(creds)
 subject_sheet = client.open_by_key(SHEET_ID).worksheet(SUBJECT)
 main_sheet = client.open_by_key(SHEET_ID).worksheet("Attendence CSE-B(2023-27)")
 
@@ -132,22 +131,25 @@ def main():
         for roll, percent, attended in results:
             if percent and roll in subj_map:
                 row = subj_map[roll]
-                subject_cells.append(gspread.Cell(row=row, col=col_index, value=percent + " %"))
+                subject_cells.append((row, col_index, percent + " %"))
                 print(f"✅ {roll} => {percent}%")
 
             if attended and roll in main_map:
                 row = main_map[roll]
-                main_cells.append(gspread.Cell(row=row, col=20, value=attended))  # col 20 = T
+                main_cells.append((row, 20, attended))  # col 20 = T
             else:
                 print(f"❌ Missing roll {roll} in Attendence CSE-B(2023-27)")
 
         if subject_cells:
-            subject_sheet.update_cells(subject_cells)
+            write_cells(subject_sheet, subject_cells)
             print(f"🟢 Subject sheet: Inserted {len(subject_cells)} % cells")
 
         if main_cells:
-            main_sheet.update_cells(main_cells)
+            write_cells(main_sheet, main_cells)
             print(f"🟢 Main sheet: Inserted {len(main_cells)} attended values")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        print_call_budget(call_budget({ws.id: ws.title for ws in (subject_sheet, main_sheet)}))
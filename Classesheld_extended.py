@@ -2,10 +2,9 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime
 from zoneinfo import ZoneInfo
-import gspread
+from sheets_common import authorize, cached_credentials, call_budget, print_call_budget
 import time
 from shutil import which
 
@@ -14,8 +13,8 @@ SHEET_ID = "168dU0XLrRkVZQquAStktg_X9pMi3Vx9o9fOmbUYOUvA"
 
 # === SETUP GOOGLE SHEETS ===
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name("credentials.json", scope)
-client = gspread.authorize(creds)
+creds = cached_credentials("credentials.json", scope)
+client = authorize(creds)
 class_sheet = client.open_by_key(SHEET_ID).worksheet("Attendence CSE-B(2023-27)")
 
 # === CHROME OPTIONS ===
@@ -70,4 +69,7 @@ def main():
     print("✅ Inserted Classes Held from A8 into J8:J20")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        print_call_budget(call_budget({class_sheet.id: class_sheet.title}))
@@ -2,12 +2,11 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from oauth2client.service_account import ServiceAccountCredentials
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from shutil import which
 from datetime import datetime
 from zoneinfo import ZoneInfo
-import gspread
+from sheets_common import authorize, cached_credentials, write_cells, call_budget, print_call_budget
 
 # === CONFIGURATION ===
 SUBJECT_CONFIGS = [
@@ -43,8 +42,8 @@ def generate_roll_numbers():
 
 def setup_gspread(cred_file):
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(cred_file, scope)
-    client = gspread.authorize(creds)
+    creds = cached_credentials(cred_file, scope)
+    client = authorize(creds)
     return client
 
 def get_roll_row_mapping(sheet, col_range, start_row):
@@ -135,26 +134,29 @@ def process_subject(subject_cfg):
 
         for roll, percent, attended in results:
             if percent and roll in subj_map:
-                subject_cells.append(gspread.Cell(row=subj_map[roll], col=col_index, value=percent + " %"))
+                subject_cells.append((subj_map[roll], col_index, percent + " %"))
                 print(f"✅ {subject} - {roll} => {percent}%")
             if attended and roll in main_map:
-                main_cells.append(gspread.Cell(row=main_map[roll], col=main_col, value=attended))
+                main_cells.append((main_map[roll], main_col, attended))
             else:
                 print(f"❌ {subject} - Missing roll {roll} in main sheet")
 
         if subject_cells:
-            subject_sheet.update_cells(subject_cells)
+            write_cells(subject_sheet, subject_cells)
             print(f"🟢 {subject} Sheet: {len(subject_cells)} % cells inserted")
         if main_cells:
-            main_sheet.update_cells(main_cells)
+            write_cells(main_sheet, main_cells)
             print(f"🟢 Main Sheet: {len(main_cells)} attended values inserted")
 
 # === TOP LEVEL PARALLEL EXECUTION ===
 if __name__ == "__main__":
-    with ThreadPoolExecutor(max_workers=len(SUBJECT_CONFIGS)) as executor:
-        futures = [executor.submit(process_subject, cfg) for cfg in SUBJECT_CONFIGS]
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                print(f"❌ Error in one subject thread: {e}")
+    try:
+        with ThreadPoolExecutor(max_workers=len(SUBJECT_CONFIGS)) as executor:
+            futures = [executor.submit(process_subject, cfg) for cfg in SUBJECT_CONFIGS]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"❌ Error in one subject thread: {e}")
+    finally:
+        print_call_budget(call_budget())
@@ -2,12 +2,11 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from oauth2client.service_account import ServiceAccountCredentials
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from shutil import which
 from datetime import datetime
 from zoneinfo import ZoneInfo
-import gspread
+from sheets_common import authorize, cached_credentials, write_cells, call_budget, print_call_budget
 
 # === CONFIGURATION ===
 SUBJECT_CONFIGS = {
@@ -38,8 +37,8 @@ if chrome_path:
 # === Setup ===
 def setup_gspread(cred_file):
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(cred_file, scope)
-    return gspread.authorize(creds)
+    creds = cached_credentials(cred_file, scope)
+    return authorize(creds)
 
 def generate_roll_numbers():
     rolls = [BASE_PREFIX + str(n) for n in range(72, 100) if str(n) not in ["80", "88"]]
@@ -137,23 +136,26 @@ def main():
                 if subject in subject_maps and roll in subject_maps[subject]:
                     row = subject_maps[subject][roll]
                     subject_updates[subject].append(
-                        gspread.Cell(row=row, col=subject_columns[subject], value=values["percent"] + " %")
+                        (row, subject_columns[subject], values["percent"] + " %")
                     )
                 if roll in main_map:
                     main_updates[subject].append(
-                        gspread.Cell(row=main_map[roll], col=SUBJECT_CONFIGS[subject]["main_col"], value=values["attended"])
+                        (main_map[roll], SUBJECT_CONFIGS[subject]["main_col"], values["attended"])
                     )
                 print(f"✅ {roll} - {subject}: {values['percent']}%")
 
     # Apply updates to all sheets
     for subject in SUBJECT_CONFIGS:
         if subject_updates[subject]:
-            subject_sheets[subject].update_cells(subject_updates[subject])
+            write_cells(subject_sheets[subject], subject_updates[subject])
             print(f"🟢 {subject} sheet updated: {len(subject_updates[subject])} cells")
 
         if main_updates[subject]:
-            main_sheet.update_cells(main_updates[subject])
+            write_cells(main_sheet, main_updates[subject])
             print(f"🟢 Main sheet updated for {subject}: {len(main_updates[subject])} attended values")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        print_call_budget(call_budget())
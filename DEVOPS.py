@@ -2,11 +2,10 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from oauth2client.service_account import ServiceAccountCredentials
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from shutil import which
 from datetime import datetime
-import gspread
+from sheets_common import authorize, cached_credentials, write_cells, call_budget, print_call_budget
 from zoneinfo import ZoneInfo
 
 # === CONFIG ===
@@ -20,8 +19,8 @@ BATCH_SIZE = THREADS  # one batch = max thread count.
 
 # === Google Sheets Setup ===
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIAL_FILE, scope)
-client = gspread.authorize(creds)
+creds = cached_credentials(CREDENTIAL_FILE, scope)
+client = authorize(creds)
 sheet = client.open_by_key(SHEET_ID).worksheet(SUBJECT)
 
 # === Chrome Options ===
@@ -122,15 +121,18 @@ def main():
                 continue
             if roll in roll_map:
                 row = roll_map[roll]
-                cell = gspread.Cell(row=row, col=col_index, value=attendance + " %")
+                cell = (row, col_index, attendance + " %")
                 batch_cells.append(cell)
                 print(f"✅ {roll} => {attendance}%")
             else:
                 print(f"❌ Roll not in sheet: {roll}")
 
         if batch_cells:
-            sheet.update_cells(batch_cells)
+            write_cells(sheet, batch_cells)
             print(f"🟢 Batch of {len(batch_cells)} rows inserted.")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        print_call_budget(call_budget({sheet.id: sheet.title}))
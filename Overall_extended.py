@@ -2,10 +2,10 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from oauth2client.service_account import ServiceAccountCredentials
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from shutil import which
-import gspread
+from sheets_common import authorize, cached_credentials, write_cells, call_budget, print_call_budget
+from run_metrics import span, write_trace
 import time
 from datetime import datetime
 from zoneinfo import ZoneInfo
@@ -18,8 +18,8 @@ BASE_PREFIX = "237Z1A05"  # ✅ Correct prefix
 
 # === Google Sheets Setup ===
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name("credentials1.json", scope)
-client = gspread.authorize(creds)
+creds = cached_credentials("credentials1.json", scope)
+client = authorize(creds)
 sheet = client.open_by_key(SHEET_ID).worksheet("Overall %")
 
 # === Setup Chrome Options ===
@@ -64,26 +64,33 @@ def generate_roll_numbers():
 # === Scraper Worker ===
 def process_roll(rollP):
     for attempt in range(1, MAX_ATTEMPTS + 1):
+        steps = {"roll": rollP[:-1], "attempt": attempt}
         try:
-            driver = webdriver.Chrome(options=chrome_options)
-            driver.set_page_load_timeout(40)
-            wait = WebDriverWait(driver, 5)
+            with span("driver launch", **steps):
+                driver = webdriver.Chrome(options=chrome_options)
+                driver.set_page_load_timeout(40)
+                wait = WebDriverWait(driver, 5)
 
-            driver.get("https://exams-nnrg.in/BeeSERP/Login.aspx")
+            with span("login: open portal", **steps):
+                driver.get("https://exams-nnrg.in/BeeSERP/Login.aspx")
 
             # Username = Password = Roll + P
-            wait.until(EC.presence_of_element_located((By.ID, "txtUserName"))).send_keys(rollP)
-            driver.find_element(By.ID, "btnNext").click()
+            with span("login: username", **steps):
+                wait.until(EC.presence_of_element_located((By.ID, "txtUserName"))).send_keys(rollP)
+                driver.find_element(By.ID, "btnNext").click()
 
-            wait.until(EC.presence_of_element_located((By.ID, "txtPassword"))).send_keys(rollP)
-            driver.find_element(By.ID, "btnSubmit").click()
+            with span("login: password", **steps):
+                wait.until(EC.presence_of_element_located((By.ID, "txtPassword"))).send_keys(rollP)
+                driver.find_element(By.ID, "btnSubmit").click()
 
             # Click Dashboard
-            wait.until(EC.presence_of_element_located((By.LINK_TEXT, "Click Here to go Student Dashbord"))).click()
+            with span("login: dashboard", **steps):
+                wait.until(EC.presence_of_element_located((By.LINK_TEXT, "Click Here to go Student Dashbord"))).click()
 
             # Get Attendance
-            wait.until(EC.presence_of_element_located((By.ID, "ctl00_cpStud_lblTotalPercentage")))
-            attendance = driver.find_element(By.ID, "ctl00_cpStud_lblTotalPercentage").text.strip()
+            with span("parse", **steps):
+                wait.until(EC.presence_of_element_located((By.ID, "ctl00_cpStud_lblTotalPercentage")))
+                attendance = driver.find_element(By.ID, "ctl00_cpStud_lblTotalPercentage").text.strip()
 
             print(f"✅ {rollP} → {attendance}")
             return (rollP[:-1], attendance)  # remove P before storing
@@ -152,12 +159,14 @@ def run_parallel_scraping():
                 batch_results[roll] = attendance
 
         # ✅ Update sheet for batch
+        batch_cells = []
         for roll, attendance in batch_results.items():
             if roll in roll_to_row:
-                row_idx = roll_to_row[roll]
-                sheet.update_cell(row_idx, col_position, attendance)
+                batch_cells.append((roll_to_row[roll], col_position, attendance))
             else:
                 print(f"⚠️ Roll {roll} not found in sheet → skipped")
+        with span("write batch", rolls=len(batch_cells)):
+            write_cells(sheet, batch_cells)
 
         time.sleep(1)
 
@@ -165,4 +174,9 @@ def run_parallel_scraping():
 
 # === MAIN ===
 if __name__ == "__main__":
-    run_parallel_scraping()
+    try:
+        run_parallel_scraping()
+    finally:
+        print_call_budget(call_budget({sheet.id: sheet.title}))
+        # Only when TRACE_FILE is set
+        write_trace()
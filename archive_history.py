@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import gzip
+import json
+import os
+import sys
+import gspread
+from sheets_common import (
+    authorize, cached_credentials, col_letter, update_cells_request, percent_format_requests, delete_columns_request,
+    run_transaction, call_budget, print_call_budget
+)
+
+# === CONFIG ===
+SHEET_ID = "168dU0XLrRkVZQquAStktg_X9pMi3Vx9o9fOmbUYOUvA"
+CREDENTIAL_FILE = os.environ.get("ARCHIVE_CREDENTIAL_FILE", "credentials1.json")
+STATE_DIR = ".scraper_state"
+ARCHIVE_DIR = os.path.join(STATE_DIR, "archive")
+# Per-semester archive spreadsheet, shared with the service account. Columns only leave the
+# live sheet once they are in there; without it the job archives locally and deletes nothing.
+ARCHIVE_SHEET_ID = os.environ.get("ARCHIVE_SHEET_ID", "")
+ARCHIVE_HEADER = ["Timestamp", "Header", "Roll", "Value", "Archived at"]
+FIRST_HISTORY_COL = 3  # C
+HEADER_ROW = 10
+
+# Columns newer than the window stay as they are; older ones are archived and
+# thinned to one per day, then one per week, and the sheet never grows past the cap.
+ARCHIVE_WINDOW_DAYS = int(os.environ.get("ARCHIVE_WINDOW_DAYS", "14"))
+DAILY_SNAPSHOT_DAYS = int(os.environ.get("DAILY_SNAPSHOT_DAYS", "60"))
+MAX_HISTORY_COLUMNS = int(os.environ.get("MAX_HISTORY_COLUMNS", "120"))
+
+SUBJECT_SHEETS = [
+    "Overall %", "FLAT", "AI", "IOT", "RP", "ML",
+    "ML LAB", "AI LAB", "IOT LAB", "IOMP",
+    "ES", "SP", "ASSOCIATION", "LIB/MEN"
+]
+
+# === Google Sheets Setup ===
+scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+creds = cached_credentials(CREDENTIAL_FILE, scope)
+client = authorize(creds)
+spreadsheet = client.open_by_key(SHEET_ID)
+archive_book = client.open_by_key(ARCHIVE_SHEET_ID) if ARCHIVE_SHEET_ID else None
+
+# === Helpers ===
+def parse_header(header):
+    # Headers start with "%Y-%m-%d %I:%M %p"; anything after that (run tags) is ignored
+    try:
+        return datetime.strptime(header.strip()[:19], "%Y-%m-%d %I:%M %p").replace(tzinfo=ZoneInfo("Asia/Kolkata"))
+    except ValueError:
+        return None
+
+def read_history(sheet):
+    rows = sheet.get_all_values()
+    header = rows[HEADER_ROW - 1] if len(rows) >= HEADER_ROW else []
+    last_col = max((i for i, v in enumerate(header, start=1) if v.strip()), default=FIRST_HISTORY_COL - 1)
+    # Append layout keeps a "latest" copy in C whose header equals the newest history column
+    append_layout = last_col > FIRST_HISTORY_COL and header[FIRST_HISTORY_COL - 1] == header[last_col - 1]
+    first_col = FIRST_HISTORY_COL + 1 if append_layout else FIRST_HISTORY_COL
+    columns, unreadable = [], []
+    for col in range(first_col, last_col + 1):
+        stamp = parse_header(header[col - 1])
+        if not stamp:
+            # e.g. a blank header left by a failed insert; the packed rewrite would drop it unarchived
+            unreadable.append(col)
+            continue
+        values = [row[col - 1] if col - 1 < len(row) else "" for row in rows[HEADER_ROW - 1:]]
+        columns.append({"col": col, "stamp": stamp, "values": values})
+    return rows, columns, unreadable, append_layout, last_col
+
+def select_kept(columns, now):
+    # Returns the columns to keep on the live sheet, newest first
+    window_start = now - timedelta(days=ARCHIVE_WINDOW_DAYS)
+    daily_start = now - timedelta(days=DAILY_SNAPSHOT_DAYS)
+    kept, seen_buckets = [], set()
+    for column in sorted(columns, key=lambda c: c["stamp"], reverse=True):
+        stamp = column["stamp"]
+        if stamp >= window_start:
+            kept.append(column)
+            continue
+        # Newest column of each day (or ISO week, further back) stands in for the rest
+        bucket = stamp.date() if stamp >= daily_start else tuple(stamp.isocalendar()[:2])
+        if bucket not in seen_buckets:
+            seen_buckets.add(bucket)
+            kept.append(column)
+    return kept[:MAX_HISTORY_COLUMNS]
+
+def column_rolls(rows):
+    return [row[0].strip() if row else "" for row in rows[HEADER_ROW:]]
+
+def archive_columns(subject, rows, columns, archived_at):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, subject.replace("/", "_").replace(" ", "_") + ".jsonl.gz")
+    rolls = column_rolls(rows)
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for column in columns:
+            values = {roll: v for roll, v in zip(rolls, column["values"][1:]) if roll}
+            f.write(json.dumps({
+                "sheet": subject,
+                "header": column["values"][0],
+                "timestamp": column["stamp"].isoformat(),
+                "archived_at": archived_at,
+                "values": values,
+            }) + "\n")
+    return path
+
+def archive_worksheet(subject):
+    try:
+        return archive_book.worksheet(subject)
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = archive_book.add_worksheet(title=subject, rows=1, cols=len(ARCHIVE_HEADER))
+        worksheet.update([ARCHIVE_HEADER], "A1")
+        return worksheet
+
+def archive_to_sheet(subject, rows, columns, archived_at):
+    # One row per (column, roll) appended to the subject's tab in the archive spreadsheet.
+    # Headers already there came from a run that archived but crashed before deleting.
+    worksheet = archive_worksheet(subject)
+    done = set(worksheet.col_values(ARCHIVE_HEADER.index("Header") + 1))
+    rolls = column_rolls(rows)
+    new_rows = [
+        [column["stamp"].isoformat(), column["values"][0], roll, value, archived_at]
+        for column in columns if column["values"][0] not in done
+        for roll, value in zip(rolls, column["values"][1:]) if roll
+    ]
+    if new_rows:
+        worksheet.append_rows(new_rows, value_input_option="RAW")
+    return len(new_rows)
+
+# === Main Execution ===
+def main():
+    now = datetime.now(ZoneInfo("Asia/Kolkata"))
+    archived_at = now.isoformat()
+    requests, refused = [], []
+    if archive_book is None:
+        print("⚠️ ARCHIVE_SHEET_ID not set: archiving locally only, no columns are removed")
+    for subject in SUBJECT_SHEETS:
+        sheet = spreadsheet.worksheet(subject)
+        rows, columns, unreadable, append_layout, last_col = read_history(sheet)
+        if unreadable:
+            print(f"🛑 {subject}: no timestamp header in {', '.join(col_letter(c) for c in unreadable)}; "
+                  f"fix or remove those columns by hand, sheet left untouched")
+            refused.append(subject)
+            continue
+        kept = select_kept(columns, now)
+        kept_cols = {c["col"] for c in kept}
+        removed = [c for c in columns if c["col"] not in kept_cols]
+        if not removed:
+            print(f"⏭️ {subject}: {len(columns)} columns, nothing to archive")
+            continue
+
+        path = archive_columns(subject, rows, removed, archived_at)
+        print(f"📦 {subject}: archived {len(removed)} columns to {path}")
+        if archive_book is None:
+            continue
+        appended = archive_to_sheet(subject, rows, removed, archived_at)
+        print(f"🗄️ {subject}: {appended} values added to the archive spreadsheet")
+
+        # Rewrite the kept columns packed against C in the sheet's own order, then drop the tail
+        ordered = sorted(kept, key=lambda c: c["stamp"], reverse=not append_layout)
+        if append_layout:
+            ordered = [{"values": ordered[-1]["values"]}] + ordered
+        grid = [list(cells) for cells in zip(*[c["values"] for c in ordered])]
+        new_last_col = FIRST_HISTORY_COL + len(ordered) - 1
+        requests.append(update_cells_request(sheet.id, HEADER_ROW, FIRST_HISTORY_COL, grid))
+        requests += percent_format_requests(sheet.id, {
+            (HEADER_ROW + i, FIRST_HISTORY_COL + j): v for i, row in enumerate(grid) for j, v in enumerate(row)
+        })
+        if new_last_col < last_col:
+            requests.append(delete_columns_request(sheet.id, new_last_col + 1, last_col))
+        print(f"🗜️ {subject}: {len(columns)} → {len(kept)} history columns "
+              f"(now ends at {col_letter(new_last_col)})")
+
+    if requests:
+        run_transaction(spreadsheet.batch_update, requests,
+                        lambda: {ws.id: ws.col_count for ws in spreadsheet.worksheets()})
+    if refused:
+        sys.exit(f"❌ Not archived, needs a look: {', '.join(refused)}")
+    print("✅ History archival done.")
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        print_call_budget(call_budget())
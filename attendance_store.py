@@ -0,0 +1,197 @@
+import os
+import json
+import sqlite3
+import threading
+
+# === CONFIG ===
+STATE_DIR = ".scraper_state"
+DB_FILE = os.path.join(STATE_DIR, "attendance.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    started_at  TEXT NOT NULL,
+    finished_at TEXT,
+    status      TEXT NOT NULL DEFAULT 'running'
+);
+CREATE TABLE IF NOT EXISTS attendance (
+    run_id     TEXT NOT NULL REFERENCES runs(run_id),
+    roll       TEXT NOT NULL,
+    subject    TEXT NOT NULL,
+    held       INTEGER,
+    attended   INTEGER,
+    percent    REAL,
+    scraped_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, roll, subject)
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_roll ON attendance(roll, subject, scraped_at);
+CREATE INDEX IF NOT EXISTS idx_attendance_subject ON attendance(subject, scraped_at);
+CREATE TABLE IF NOT EXISTS published_cells (
+    sheet TEXT NOT NULL,
+    row   INTEGER NOT NULL,
+    col   INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (sheet, row, col)
+);
+CREATE TABLE IF NOT EXISTS publish_queue (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id      TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    enqueued_at TEXT NOT NULL,
+    sent_at     TEXT,
+    last_error  TEXT,
+    UNIQUE (run_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_publish_queue_status ON publish_queue(status, id);
+"""
+
+# One connection per process, shared by the pipeline threads behind a lock
+_conn = None
+_lock = threading.Lock()
+
+# === CONNECTION ===
+def get_store():
+    global _conn
+    with _lock:
+        if _conn is None:
+            os.makedirs(STATE_DIR, exist_ok=True)
+            _conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+            _conn.execute("PRAGMA foreign_keys=ON")
+            _conn.executescript(SCHEMA)
+            # Stores cached from before the column existed
+            columns = {row[1] for row in _conn.execute("PRAGMA table_info(publish_queue)")}
+            if "last_error" not in columns:
+                _conn.execute("ALTER TABLE publish_queue ADD COLUMN last_error TEXT")
+        return _conn
+
+def to_number(value, cast=float):
+    try:
+        return cast(str(value).replace("%", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+# === RUNS ===
+def start_run(run_id, started_at):
+    conn = get_store()
+    with _lock, conn:
+        conn.execute(
+            "INSERT INTO runs (run_id, started_at) VALUES (?, ?) "
+            "ON CONFLICT(run_id) DO UPDATE SET status = 'running', finished_at = NULL",
+            (run_id, started_at),
+        )
+
+def finish_run(run_id, finished_at, status):
+    conn = get_store()
+    with _lock, conn:
+        conn.execute("UPDATE runs SET finished_at = ?, status = ? WHERE run_id = ?", (finished_at, status, run_id))
+
+# === ATTENDANCE ===
+def save_attendance(run_id, records):
+    # records: iterable of (roll, subject, held, attended, percent, scraped_at), written in one transaction
+    rows = [
+        (run_id, roll, subject, to_number(held, int), to_number(attended, int), to_number(percent), scraped_at)
+        for roll, subject, held, attended, percent, scraped_at in records
+    ]
+    conn = get_store()
+    with _lock, conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO attendance (run_id, roll, subject, held, attended, percent, scraped_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    return len(rows)
+
+# === PUBLISHED SNAPSHOT ===
+# What the sheets held after the last successful publish, so the next run only sends changes
+def load_published():
+    conn = get_store()
+    with _lock:
+        rows = conn.execute("SELECT sheet, row, col, value FROM published_cells").fetchall()
+    return {(sheet, row, col): value for sheet, row, col, value in rows}
+
+def clear_published():
+    # The sheets no longer match the snapshot; the next run sends every cell again
+    conn = get_store()
+    with _lock, conn:
+        conn.execute("DELETE FROM published_cells")
+
+def save_published(cells):
+    conn = get_store()
+    with _lock, conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO published_cells (sheet, row, col, value) VALUES (?, ?, ?, ?)",
+            [(sheet, row, col, str(value)) for (sheet, row, col), value in cells.items()],
+        )
+
+# === PUBLISH QUEUE ===
+# Write-ahead queue of batchUpdate bodies; the publisher keeps each worksheet's batches in order.
+# A run enqueues in several flushes, each continuing the run's batch numbering. A batch Sheets
+# rejects outright (400/403) is moved to 'failed' with its error, so the rest can drain.
+def enqueue_publish(run_id, chunks, enqueued_at):
+    conn = get_store()
+    with _lock, conn:
+        first = conn.execute(
+            "SELECT COALESCE(MAX(seq) + 1, 0) FROM publish_queue WHERE run_id = ?", (run_id,)
+        ).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO publish_queue (run_id, seq, payload, enqueued_at) VALUES (?, ?, ?, ?)",
+            [(run_id, first + i, json.dumps(chunk), enqueued_at) for i, chunk in enumerate(chunks)],
+        )
+    return len(chunks)
+
+def pending_items():
+    conn = get_store()
+    with _lock:
+        rows = conn.execute(
+            "SELECT id, run_id, seq, payload, attempts FROM publish_queue WHERE status = 'pending' ORDER BY id"
+        ).fetchall()
+    return [
+        {"id": item_id, "run_id": run_id, "seq": seq, "chunk": json.loads(payload), "attempts": attempts}
+        for item_id, run_id, seq, payload, attempts in rows
+    ]
+
+def mark_attempt(item_id):
+    conn = get_store()
+    with _lock, conn:
+        conn.execute("UPDATE publish_queue SET attempts = attempts + 1 WHERE id = ?", (item_id,))
+
+def mark_sent(item_id, sent_at):
+    conn = get_store()
+    with _lock, conn:
+        conn.execute("UPDATE publish_queue SET status = 'sent', sent_at = ? WHERE id = ?", (sent_at, item_id))
+        # A run left "queued" is complete once its last batch is out
+        conn.execute(
+            "UPDATE runs SET status = 'completed' WHERE status = 'queued' AND run_id = "
+            "(SELECT run_id FROM publish_queue WHERE id = ?) AND NOT EXISTS "
+            "(SELECT 1 FROM publish_queue WHERE run_id = runs.run_id AND status = 'pending')",
+            (item_id,),
+        )
+
+def mark_failed(item_id, error):
+    # Also drops the published snapshot, which already counted this batch's cells as on the sheet
+    conn = get_store()
+    with _lock, conn:
+        conn.execute("UPDATE publish_queue SET status = 'failed', last_error = ? WHERE id = ?", (error, item_id))
+        conn.execute(
+            "UPDATE runs SET status = 'publish_failed' WHERE run_id = (SELECT run_id FROM publish_queue WHERE id = ?)",
+            (item_id,),
+        )
+        conn.execute("DELETE FROM published_cells")
+
+def failed_items(run_id=None):
+    conn = get_store()
+    query = "SELECT run_id, seq, attempts, last_error FROM publish_queue WHERE status = 'failed'"
+    with _lock:
+        rows = conn.execute(query + (" AND run_id = ?" if run_id else "") + " ORDER BY id",
+                            (run_id,) if run_id else ()).fetchall()
+    return [{"run_id": r, "batch": seq + 1, "attempts": attempts, "error": error} for r, seq, attempts, error in rows]
+
+def pending_count():
+    conn = get_store()
+    with _lock:
+        return conn.execute("SELECT COUNT(*) FROM publish_queue WHERE status = 'pending'").fetchone()[0]
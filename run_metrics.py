@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from contextlib import contextmanager
+
+# === CONFIG ===
+PERCENTILES = (50, 95, 99)
+# Opt-in: when set, the run is also written as a Chrome trace-event file for
+# chrome://tracing or Perfetto
+TRACE_FILE = os.environ.get("TRACE_FILE")
+# Spans drawn on the calling thread's Sheets track rather than its main track
+SHEETS_TRACK_PREFIXES = ("sheets ", "quota wait", "credential switch", "429 wait", "retry wait")
+# Upper bounds (seconds) of the step latency histogram buckets on /metrics
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+
+# Every timed step of the run, from any thread: name, thread, start/end (seconds since
+# RUN_START) and attributes such as the roll it belongs to
+RUN_START = time.time()
+SPANS = []
+_lock = threading.Lock()
+
+# === SPANS ===
+@contextmanager
+def span(name, **attrs):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_span(name, start, time.time(), **attrs)
+
+def record_span(name, start, end, **attrs):
+    entry = {
+        "name": name,
+        "thread": threading.current_thread().name,
+        "start": start - RUN_START,
+        "end": end - RUN_START,
+        **attrs,
+    }
+    with _lock:
+        SPANS.append(entry)
+    observe("scraper_step_seconds", end - start, step=name)
+
+def spans():
+    with _lock:
+        return list(SPANS)
+
+def reset_spans():
+    # Long-running mode starts every run with a clean timeline; /metrics counters keep counting
+    global RUN_START
+    with _lock:
+        SPANS.clear()
+        RUN_START = time.time()
+
+# === AGGREGATION ===
+def percentile(values, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not values:
+        return None
+    rank = max(1, -(-pct * len(values) // 100))
+    return values[min(rank, len(values)) - 1]
+
+def distribution(values):
+    values = sorted(values)
+    summary = {"count": len(values), "total": round(sum(values), 3), "max": round(values[-1], 3) if values else None}
+    for pct in PERCENTILES:
+        value = percentile(values, pct)
+        summary[f"p{pct}"] = round(value, 3) if value is not None else None
+    return summary
+
+def summarize():
+    recorded = spans()
+    by_step, by_roll = {}, {}
+    for s in recorded:
+        duration = s["end"] - s["start"]
+        by_step.setdefault(s["name"], []).append(duration)
+        if "roll" in s:
+            steps = by_roll.setdefault(s["roll"], {})
+            steps[s["name"]] = steps.get(s["name"], 0) + duration
+
+    rolls = {
+        roll: {"total": round(sum(steps.values()), 3), "steps": {k: round(v, 3) for k, v in steps.items()}}
+        for roll, steps in sorted(by_roll.items())
+    }
+    # Run phases in the order they started: every span that isn't per roll or per Sheets call
+    timeline = [
+        {"name": s["name"], "thread": s["thread"], "start": round(s["start"], 3), "end": round(s["end"], 3)}
+        for s in sorted(recorded, key=lambda s: s["start"])
+        if "roll" not in s and not s["name"].startswith(SHEETS_TRACK_PREFIXES)
+    ]
+    return {
+        "steps": {name: distribution(durations) for name, durations in sorted(by_step.items())},
+        "per_roll": distribution([r["total"] for r in rolls.values()]),
+        "rolls": rolls,
+        "timeline": timeline,
+    }
+
+# === TRACE EXPORT ===
+def write_trace(path=None):
+    # One track per thread, plus a "sheets" track beside each thread that talks to the API, so
+    # Sheets calls, quota waits and credential switches line up under the work that made them.
+    # Complete events on one track have to nest, which spans from a single thread always do.
+    path = path or TRACE_FILE
+    if not path:
+        return None
+    tids, events = {}, []
+    for s in sorted(spans(), key=lambda s: s["start"]):
+        track = f"{s['thread']} sheets" if s["name"].startswith(SHEETS_TRACK_PREFIXES) else s["thread"]
+        tid = tids.setdefault(track, len(tids) + 1)
+        args = {k: v for k, v in s.items() if k not in ("name", "start", "end")}
+        events.append({
+            "name": s["name"], "cat": track, "ph": "X", "pid": 1, "tid": tid,
+            "ts": round(s["start"] * 1e6), "dur": round((s["end"] - s["start"]) * 1e6), "args": args,
+        })
+    events += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": track}} for track, tid in tids.items()]
+    # Each thread's Sheets track sorts right under the thread
+    events += [{"name": "thread_sort_index", "ph": "M", "pid": 1, "tid": tids[track], "args": {"sort_index": i}}
+               for i, track in enumerate(sorted(tids))]
+    events.append({"name": "process_name", "ph": "M", "pid": 1, "args": {"name": os.path.basename(sys.argv[0]) or "scraper"}})
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    print(f"🧵 Trace with {len(events)} events written to {path}")
+    return path
+
+# === PROMETHEUS METRICS ===
+# Counters, gauges and histograms kept for the life of the process and served as
+# Prometheus text on /metrics while the scraper runs as a service. Keyed by metric
+# name plus a sorted tuple of label pairs.
+METRIC_HELP = {
+    "scraper_rolls_total": ("counter", "Rolls scraped, by result (scraped or failed)"),
+    "scraper_login_attempts_total": ("counter", "Portal login attempts, by outcome"),
+    "scraper_runs_total": ("counter", "Scraper runs, by final status"),
+    "scraper_sheets_requests_total": ("counter", "Sheets API requests sent, by HTTP method"),
+    "scraper_sheets_throttled_total": ("counter", "Sheets API 429 responses, by credential"),
+    "scraper_http_connections_total": ("counter", "Sheets API requests by connection: new (opened for it) or reused"),
+    "scraper_live_browsers": ("gauge", "Chrome sessions currently open"),
+    "scraper_queue_depth": ("gauge", "Items waiting behind each pipeline stage, as last seen"),
+    "scraper_publish_queue_pending": ("gauge", "Batches waiting in the durable publish queue"),
+    "scraper_publish_failed_total": ("counter", "Batches Sheets rejected outright, moved to failed"),
+    "scraper_last_run_timestamp_seconds": ("gauge", "Unix time the last run finished, by status"),
+    "scraper_step_seconds": ("histogram", "Duration of each timed step of a run"),
+    "process_resident_memory_bytes": ("gauge", "Resident memory of the scraper process"),
+}
+COUNTERS = {}
+GAUGES = {}
+HISTOGRAMS = {}
+WATCHED = {}  # values read when /metrics is scraped: (name, labels) → function returning the value
+_metrics_lock = threading.Lock()
+
+def metric_key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def count(name, value=1, **labels):
+    key = metric_key(name, labels)
+    with _metrics_lock:
+        COUNTERS[key] = COUNTERS.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    with _metrics_lock:
+        GAUGES[metric_key(name, labels)] = value
+
+def add_gauge(name, delta, **labels):
+    key = metric_key(name, labels)
+    with _metrics_lock:
+        GAUGES[key] = GAUGES.get(key, 0) + delta
+
+def watch(name, read, **labels):
+    WATCHED[metric_key(name, labels)] = read
+
+def observe(name, value, **labels):
+    key = metric_key(name, labels)
+    with _metrics_lock:
+        h = HISTOGRAMS.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                h["buckets"][i] += 1
+        h["sum"] += value
+        h["count"] += 1
+
+def resident_memory():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels) + "}"
+
+def render_metrics():
+    for key, read in list(WATCHED.items()) + [(metric_key("process_resident_memory_bytes", {}), resident_memory)]:
+        try:
+            value = read()
+        except Exception:
+            value = None
+        if value is not None:
+            with _metrics_lock:
+                GAUGES[key] = value
+
+    with _metrics_lock:
+        samples = {}
+        for (name, labels), value in sorted(list(COUNTERS.items()) + list(GAUGES.items())):
+            samples.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), h in sorted(HISTOGRAMS.items()):
+            lines = samples.setdefault(name, [])
+            buckets = list(zip(map(str, LATENCY_BUCKETS), h["buckets"])) + [("+Inf", h["count"])]
+            for bound, n in buckets:
+                le = format_labels(labels + (("le", bound),))
+                lines.append(f"{name}_bucket{le} {n}")
+            lines.append(f"{name}_sum{format_labels(labels)} {round(h['sum'], 6)}")
+            lines.append(f"{name}_count{format_labels(labels)} {h['count']}")
+
+    out = []
+    for name in sorted(samples):
+        kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+        out += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + samples[name]
+    return "\n".join(out) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve_metrics(port=None, host=None):
+    # Local only by default; the scrape runs in a daemon thread next to the scraper
+    server = ThreadingHTTPServer((host or METRICS_HOST, METRICS_PORT if port is None else port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"📈 Metrics on http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+    return server
+
+# === REPORT ===
+def write_report(path, **summary):
+    report = {
+        "started_at": datetime.fromtimestamp(RUN_START, ZoneInfo("Asia/Kolkata")).isoformat(),
+        "wall_seconds": round(time.time() - RUN_START, 3),
+        **summary,
+        **summarize(),
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("🕒 Run timeline:")
+    for p in report["timeline"]:
+        print(f"   {p['start']:7.1f}s → {p['end']:7.1f}s  {p['name']} [{p['thread']}]")
+    print(f"🕒 Run took {report['wall_seconds']:.1f}s. Slowest steps by total time:")
+    slowest = sorted(report["steps"].items(), key=lambda item: item[1]["total"], reverse=True)[:10]
+    for name, s in slowest:
+        print(f"   {s['total']:8.1f}s  {name} ×{s['count']} (p50 {s['p50']:.2f}s, p95 {s['p95']:.2f}s, p99 {s['p99']:.2f}s)")
+    if report["per_roll"]["count"]:
+        r = report["per_roll"]
+        print(f"   per roll: p50 {r['p50']:.1f}s, p95 {r['p95']:.1f}s, p99 {r['p99']:.1f}s over {r['count']} rolls")
+    return report
@@ -1,15 +1,16 @@
 import os
 import time
+import threading
 import gspread
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from shutil import which
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from oauth2client.service_account import ServiceAccountCredentials
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from sheets_common import authorize, cached_credentials, write_cells, call_budget, print_call_budget
 
 # === CONFIG ===
 SHEET_ID = "168dU0XLrRkVZQquAStktg_X9pMi3Vx9o9fOmbUYOUvA"
@@ -35,10 +36,12 @@ SUBJECT_ALIASES = {
 # === GOOGLE SHEETS SETUP ===
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
+SWITCH_LOCK = threading.Lock()
+
 def get_gspread_client():
     cred_file = CREDENTIAL_FILES[CURRENT_CRED_INDEX]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(cred_file, scope)
-    return gspread.authorize(creds)
+    creds = cached_credentials(cred_file, scope)
+    return authorize(creds)
 
 def switch_credentials():
     global CURRENT_CRED_INDEX
@@ -49,13 +52,17 @@ def switch_credentials():
 def safe_call(func, *args, **kwargs):
     global client
     for _ in range(len(CREDENTIAL_FILES)):
+        current = client
         try:
             return func(*args, **kwargs)
         except gspread.exceptions.APIError as e:
             if e.response.status_code == 429:
-                print("⚠️ Rate limit. Switching creds...")
-                client = switch_credentials()
-                refresh_sheets()
+                # Parallel writers hit the same 429 together; only the first one switches
+                with SWITCH_LOCK:
+                    if client is current:
+                        print("⚠️ Rate limit. Switching creds...")
+                        client = switch_credentials()
+                        refresh_sheets()
             else:
                 raise e
     raise RuntimeError("All credentials exhausted.")
@@ -175,20 +182,16 @@ def run_fast_scraper():
                     batched_data[subject].append((row, col, val if subject == "Overall %" else val + " %"))
 
     print("📝 Writing scraped data...")
-    for subject, updates in batched_data.items():
-        if not updates:
-            continue
-        rows = list(set(row for row, col, val in updates))
-        min_row, max_row = min(rows), max(rows)
-        col = col_index[subject]
-        cell_range = f"{chr(64 + col)}{min_row}:{chr(64 + col)}{max_row}"
-        cell_objs = safe_call(sheets[subject].range, cell_range)
-        cell_map = {(cell.row, cell.col): cell for cell in cell_objs}
-        for row, col, val in updates:
-            if (row, col) in cell_map:
-                cell_map[(row, col)].value = val
-        safe_call(sheets[subject].update_cells, list(cell_map.values()))
+    def publish(subject):
+        safe_call(lambda: write_cells(sheets[subject], batched_data[subject]))
         print(f"✅ {subject} updated")
 
+    # Subject sheets are independent, so they are written side by side
+    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
+        list(executor.map(publish, [s for s in SUBJECT_SHEETS if batched_data[s]]))
+
 if __name__ == "__main__":
-    run_fast_scraper()
+    try:
+        run_fast_scraper()
+    finally:
+        print_call_budget(call_budget({ws.id: ws.title for ws in [*sheets.values(), class_sheet]}))
@@ -1,15 +1,35 @@
 import os
+import json
 import time
+import glob
+import argparse
+import threading
+import queue
 import gspread
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from shutil import which
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from oauth2client.service_account import ServiceAccountCredentials
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from attendance_store import (
+    start_run, finish_run, save_attendance, load_published, save_published,
+    enqueue_publish, pending_items, mark_attempt, mark_sent, mark_failed, failed_items, pending_count,
+    clear_published
+)
+from run_metrics import (
+    span, reset_spans, write_report, write_trace, count, set_gauge, add_gauge, watch, serve_metrics
+)
+from sheets_common import (
+    authorize, connection_stats, call_budget, print_call_budget, reset_calls, rank_credentials, record_throttle,
+    parse_a1, insert_column_request, append_columns_request, update_cells_request,
+    percent_format_requests, copy_paste_request, clear_range_request,
+    contiguous_runs, contiguous_blocks, chunk_requests, sheet_lanes, run_transaction, section_held,
+    error_status, is_retryable
+)
 
 # === CONFIG ===
 SHEET_ID = "168dU0XLrRkVZQquAStktg_X9pMi3Vx9o9fOmbUYOUvA"
@@ -18,6 +38,33 @@ CREDENTIAL_FILES = [f"credentials{i}.json" for i in range(1, 15)]
 CURRENT_CRED_INDEX = 0
 MAX_ATTEMPTS = 3
 MAX_THREADS = 8
+NEW_COLUMN = 3  # each run's column goes in at C, right after Name
+RUN_COL = 0  # stands for "this run's column" in published-cell keys, wherever the layout puts it
+CLASS_SHEET = "Attendence CSE-B(2023-27)"
+# "insert": every run inserts its column at C, pushing history right (newest first).
+# "append": C is a fixed "latest" column and each run's history column is added at the
+# right edge (oldest first), so nothing shifts. Switch only after `migrate-layout`.
+HISTORY_LAYOUT = os.environ.get("HISTORY_LAYOUT", "insert")
+# Tagged into each run's header cell so a retried or re-triggered run finds and reuses its
+# column instead of inserting another one. Re-runs of a GitHub workflow share GITHUB_RUN_ID.
+RUN_ID = os.environ.get("RUN_ID") or (f"gh{os.environ['GITHUB_RUN_ID']}" if os.environ.get("GITHUB_RUN_ID") else "")
+
+# Classes held blocks on the class sheet and the reference roll feeding each:
+# 72 for the first section (D8:D20) and A8 for the second (J8:J20). Their held
+# columns also fingerprint the whole class between runs.
+HELD_RANGES = {"D8:D20": "237Z1A0572P", "J8:J20": "237Z1A05A8P"}
+REFERENCE_ROLLS = list(HELD_RANGES.values())
+STATE_DIR = ".scraper_state"
+FINGERPRINT_FILE = os.path.join(STATE_DIR, "held_fingerprint.json")
+RUN_REPORT_FILE = os.path.join(STATE_DIR, "run_report.json")
+JOURNAL_DIR = os.path.join(STATE_DIR, "journal")
+JOURNAL_KEEP = 10  # finished journals kept around for inspection
+PUBLISH_RETRY_WAIT = 60  # seconds between publish attempts once every credential is throttled
+PUBLISH_THREADS = 8  # queued batches on disjoint worksheets published at once; the quota coordinator paces them further
+PUBLISH_TIMEOUT = int(os.environ.get("PUBLISH_TIMEOUT", "900"))  # how long a run waits on Sheets before leaving a backlog
+SERVE_INTERVAL = int(os.environ.get("SERVE_INTERVAL", "1800"))  # seconds between runs in `serve` mode
+AGGREGATE_BATCH = 8  # rolls per publish flush
+AGGREGATE_INTERVAL = 5  # seconds before a partial batch is flushed anyway
 
 SUBJECT_SHEETS = [
     "Overall %", "FLAT", "AI", "IOT", "RP", "ML",
@@ -32,6 +79,8 @@ SUBJECT_ALIASES = {
     "LIB/MEN": "LIB/MEN", "LIB/MEN": "LIB/MEN"
 }
 
+# Rolls on the class sheet, one per row; attended counts are written against these rows
+CLASS_ROLL_RANGE = "B27:B91"
 SUBJECT_ClassesAttended_RANGES = {
     "ML": "F27:F91",
     "FLAT": "H27:H91",
@@ -51,38 +100,56 @@ SUBJECT_ClassesAttended_RANGES = {
 # === GOOGLE SHEETS SETUP ===
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
+# Loaded and tokened concurrently at startup, best-scored key first; switches walk this order
+with span("credential setup"):
+    CREDENTIAL_POOL = rank_credentials(CREDENTIAL_FILES, scope)
+if not CREDENTIAL_POOL:
+    raise RuntimeError("No usable credential files.")
+
+SWITCH_LOCK = threading.Lock()
+# Held for as long as a thread drains the publish queue; two drainers could both send the same
+# untried batch, and a resent column insert duplicates the column
+DRAIN_LOCK = threading.Lock()
+
 def get_gspread_client():
-    cred_file = CREDENTIAL_FILES[CURRENT_CRED_INDEX]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(cred_file, scope)
-    return gspread.authorize(creds)
+    return authorize(CREDENTIAL_POOL[CURRENT_CRED_INDEX]["creds"])
 
 def switch_credentials():
     global CURRENT_CRED_INDEX
-    CURRENT_CRED_INDEX = (CURRENT_CRED_INDEX + 1) % len(CREDENTIAL_FILES)
-    print(f"🔄 Switched to credential file: {CREDENTIAL_FILES[CURRENT_CRED_INDEX]}")
+    CURRENT_CRED_INDEX = (CURRENT_CRED_INDEX + 1) % len(CREDENTIAL_POOL)
+    print(f"🔄 Switched to credential file: {CREDENTIAL_POOL[CURRENT_CRED_INDEX]['file']}")
     return get_gspread_client()
 
 def safe_call(func, *args, **kwargs):
     global client
-    for _ in range(len(CREDENTIAL_FILES)):
+    for _ in range(len(CREDENTIAL_POOL)):
+        current = client
         try:
             return func(*args, **kwargs)
         except gspread.exceptions.APIError as e:
             if e.response.status_code == 429:
-                print("⚠️ Rate limit. Switching creds...")
-                client = switch_credentials()
-                refresh_sheets()
+                # Publisher threads hit the same 429 together; only the first one switches
+                with SWITCH_LOCK, span("credential switch"):
+                    if client is current:
+                        print("⚠️ Rate limit. Switching creds...")
+                        record_throttle(CREDENTIAL_POOL[CURRENT_CRED_INDEX]["email"])
+                        client = switch_credentials()
+                        refresh_sheets()
             else:
                 raise e
     raise RuntimeError("All credentials exhausted.")
 
 def refresh_sheets():
-    global sheets, class_sheet
-    sheets = {name: client.open_by_key(SHEET_ID).worksheet(name) for name in SUBJECT_SHEETS}
-    class_sheet = client.open_by_key(SHEET_ID).worksheet("Attendence CSE-B(2023-27)")
+    global spreadsheet, sheets, class_sheet
+    spreadsheet = client.open_by_key(SHEET_ID)
+    # One metadata fetch for every tab, so a switch costs two calls rather than sixteen
+    by_title = {ws.title: ws for ws in spreadsheet.worksheets()}
+    sheets = {name: by_title[name] for name in SUBJECT_SHEETS}
+    class_sheet = by_title[CLASS_SHEET]
 
-client = get_gspread_client()
-refresh_sheets()
+with span("open spreadsheet"):
+    client = get_gspread_client()
+    refresh_sheets()
 
 # === SELENIUM SETUP ===
 chrome_options = webdriver.ChromeOptions()
@@ -102,139 +169,794 @@ def generate_roll_numbers():
     rolls += [BASE_PREFIX + f"{l}{d}" for l in "ABCD" for d in range(10)]
     return [r + "P" for r in rolls]
 
-def get_roll_row_mapping(sheet):
-    rows = safe_call(sheet.get_all_values)
-    return {row[0].strip(): idx for idx, row in enumerate(rows[10:], start=11) if row and row[0].strip()}
+def run_tag(run_id):
+    return f"[{run_id}]"
+
+def run_header(timestamp, run_id):
+    return f"{timestamp} {run_tag(run_id)}"
+
+def find_run_column(header, run_id):
+    # History column already carrying this run's tag, if an earlier attempt created it
+    cols = [i for i, v in enumerate(header, start=1) if run_tag(run_id) in v]
+    if HISTORY_LAYOUT == "append":
+        cols = [c for c in cols if c != NEW_COLUMN]
+    return cols[-1] if cols else None
+
+def get_sheet_layout(subject, run_id):
+    rows = safe_call(lambda: sheets[subject].get_all_values())
+    roll_map = {row[0].strip(): idx for idx, row in enumerate(rows[10:], start=11) if row and row[0].strip()}
+    # Last timestamp header on row 10 marks where the history columns end
+    header = rows[9] if len(rows) > 9 else []
+    last_col = max((i for i, v in enumerate(header, start=1) if v.strip()), default=NEW_COLUMN - 1)
+    return roll_map, last_col, find_run_column(header, run_id)
+
+def get_class_roll_map():
+    start_row = parse_a1(CLASS_ROLL_RANGE)[0]
+    rows = safe_call(lambda: class_sheet.get(CLASS_ROLL_RANGE))
+    return {row[0].strip(): idx for idx, row in enumerate(rows, start=start_row) if row and row[0].strip()}
+
+def prepare_sheets(run_id):
+    # Nothing here depends on the portal, so it runs alongside the scrape. Earlier runs'
+    # queued batches go first: the layout read below has to see their columns.
+    with span("flush publish backlog"):
+        if pending_count() and not drain_publish_queue(PUBLISH_TIMEOUT):
+            raise RuntimeError("Publish backlog not flushed; results are journaled, finish with --resume")
+    with span("roll mapping"):
+        layouts = {s: get_sheet_layout(s, run_id) for s in SUBJECT_SHEETS}
+        class_roll_map = get_class_roll_map()
+    roll_map, last_cols, run_cols = ({s: layouts[s][i] for s in SUBJECT_SHEETS} for i in range(3))
+    reused = [s for s in SUBJECT_SHEETS if run_cols[s]]
+    if reused:
+        print(f"♻️ Run {run_id} already has a column on {len(reused)} sheets, reusing it")
+    return roll_map, class_roll_map, last_cols, run_cols
+
+def applied_run_tags(run_id):
+    # One read of every subject sheet's header row; used before re-sending structural changes
+    ranges = [f"'{s}'!10:10" for s in SUBJECT_SHEETS]
+    response = safe_call(lambda: spreadsheet.values_batch_get(ranges))
+    return {
+        subject for subject, value_range in zip(SUBJECT_SHEETS, response.get("valueRanges", []))
+        if find_run_column((value_range.get("values") or [[]])[0], run_id)
+    }
+
+# === RUN TRANSACTION ===
+# A run's new columns and headers go out in the first batchUpdate, its values follow in
+# small batches as rolls come in. Only cells that differ from what the last run published
+# are sent; the new history column starts as a server-side copy of the previous one, so
+# rolls not yet scraped show their last known value rather than a gap.
+def run_columns(subject, last_col, copy_previous, run_col):
+    # Columns this run writes to on a subject sheet, plus the structural requests creating them
+    sheet = sheets[subject]
+    data_rows = (11, sheet.row_count)
+    if run_col:
+        return ([NEW_COLUMN, run_col] if HISTORY_LAYOUT == "append" else [run_col]), []
+    if HISTORY_LAYOUT != "append":
+        requests = [insert_column_request(sheet.id, NEW_COLUMN)]
+        if copy_previous:
+            # After the insert the previous run sits in D
+            requests.append(copy_paste_request(sheet.id, (data_rows[0], NEW_COLUMN + 1, data_rows[1], NEW_COLUMN + 1),
+                                               (data_rows[0], NEW_COLUMN, data_rows[1], NEW_COLUMN)))
+        return [NEW_COLUMN], requests
+
+    history_col = last_col + 1
+    requests = []
+    if history_col > sheet.col_count:
+        requests.append(append_columns_request(sheet.id, history_col - sheet.col_count))
+    if copy_previous:
+        requests.append(copy_paste_request(sheet.id, (data_rows[0], last_col, data_rows[1], last_col),
+                                           (data_rows[0], history_col, data_rows[1], history_col)))
+    else:
+        requests.append(clear_range_request(sheet.id, f"C11:C{sheet.row_count}"))
+    return [NEW_COLUMN, history_col], requests
+
+def subject_cells(roll_map, result):
+    # One roll's values on every subject sheet it appears on; blanks clear whatever an
+    # earlier run left in rows this run has no figure for
+    cells = {}
+    for subject in SUBJECT_SHEETS:
+        row = roll_map[subject].get(result["roll"])
+        if row is None:
+            continue
+        val = result["percent"].get(subject, "")
+        cells[(subject, row, RUN_COL)] = val if subject == "Overall %" or not val else val + " %"
+    return cells
+
+def attended_cells(class_roll_map, roll, attended):
+    # Each roll's attended counts go on its own class sheet row; a roll missing from this
+    # batch leaves its row alone rather than pulling the rolls below it up
+    row = class_roll_map.get(roll)
+    if row is None:
+        return {}
+    return {
+        (CLASS_SHEET, row, parse_a1(cell_range)[1]): attended.get(subject, "")
+        for subject, cell_range in SUBJECT_ClassesAttended_RANGES.items()
+    }
+
+def held_cells(held_blocks):
+    # Classes held blocks need the whole class, so they go out with the last flush
+    cells = {}
+    for cell_range, held in held_blocks.items():
+        start_row, col, _, _ = parse_a1(cell_range)
+        for offset, value in enumerate(held):
+            cells[(CLASS_SHEET, start_row + offset, col)] = value
+    return cells
+
+def structural_requests(header, published, last_cols, run_cols):
+    # New run columns and their headers; sent once, ahead of the first values
+    published_sheets = {sheet for sheet, _, _ in published}
+    requests, target_cols = [], {}
+    for subject in SUBJECT_SHEETS:
+        target_cols[subject], structural = run_columns(subject, last_cols[subject], subject in published_sheets, run_cols[subject])
+        requests += structural
+        if run_cols[subject]:
+            # Reused column: its tagged header is already there. Writing it again would make
+            # send_chunk take any retry of this batch as applied and drop its values.
+            continue
+        for col in target_cols[subject]:
+            requests.append(update_cells_request(sheets[subject].id, 10, col, [[header]]))
+    return requests, target_cols
+
+def value_requests(changed, target_cols):
+    requests = []
+    for subject in SUBJECT_SHEETS:
+        subject_changes = {(row, RUN_COL): v for (sheet, row, _), v in changed.items() if sheet == subject}
+        for col in target_cols[subject]:
+            for start_row, _, values in contiguous_runs(subject_changes):
+                requests.append(update_cells_request(sheets[subject].id, start_row, col, [[v] for v in values]))
+            # Percentages go out as fractions; whichever rows hold one get the percent format,
+            # whatever the sheet (the portal's overall label may or may not carry a "%")
+            requests += percent_format_requests(sheets[subject].id, {(row, col): v for (row, _), v in subject_changes.items()})
+
+    class_changes = {(row, col): v for (sheet, row, col), v in changed.items() if sheet == CLASS_SHEET}
+    for start_row, start_col, rows in contiguous_blocks(class_changes):
+        requests.append(update_cells_request(class_sheet.id, start_row, start_col, rows))
+    return requests
+
+def send_batch_update(body):
+    # Looks up the spreadsheet at call time so a retry after a credential switch uses the new client
+    return safe_call(lambda: spreadsheet.batch_update(body))
+
+# === LAYOUT MIGRATION ===
+def migrate_to_append_layout():
+    # One-time rewrite of insert-layout history (C newest, then older to the right) into the
+    # append layout: C keeps the latest values and D onwards runs oldest to newest.
+    requests = []
+    for subject in SUBJECT_SHEETS:
+        sheet = sheets[subject]
+        rows = safe_call(lambda: sheet.get_all_values())
+        header = rows[9] if len(rows) > 9 else []
+        last_col = max((i for i, v in enumerate(header, start=1) if v.strip()), default=NEW_COLUMN - 1)
+        if last_col < NEW_COLUMN:
+            print(f"⏭️ {subject}: no history to migrate")
+            continue
+        if last_col > NEW_COLUMN and header[NEW_COLUMN - 1] == header[last_col - 1]:
+            print(f"⏭️ {subject}: already in append layout")
+            continue
+        history = [[row[c] if c < len(row) else "" for c in range(NEW_COLUMN - 1, last_col)] for row in rows[9:]]
+        migrated = [[row[0]] + row[::-1] for row in history]
+        if last_col + 1 > sheet.col_count:
+            requests.append(append_columns_request(sheet.id, last_col + 1 - sheet.col_count))
+        requests.append(update_cells_request(sheet.id, 10, NEW_COLUMN, migrated))
+        requests += percent_format_requests(sheet.id, {
+            (10 + i, NEW_COLUMN + j): v for i, row in enumerate(migrated) for j, v in enumerate(row)
+        })
+        print(f"🔁 {subject}: {last_col - NEW_COLUMN + 1} history columns reordered")
+    if requests:
+        run_transaction(send_batch_update, requests,
+                        lambda: safe_call(lambda: {ws.id: ws.col_count for ws in spreadsheet.worksheets()}))
+    print("✅ Migration done. Set HISTORY_LAYOUT=append for the following runs.")
+
+# === RUN REPORT ===
+# Per pipeline stage: items handled, seconds spent working and the deepest its output queue got
+STAGE_STATS = {}
+STAGE_LOCK = threading.Lock()
 
-def prepare_new_column(sheet):
-    timestamp = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%Y-%m-%d %I:%M %p")
-    safe_call(sheet.insert_cols, [[]], 3)
-    safe_call(sheet.update_cell, 10, 3, timestamp)
-    return 3
+def write_run_report(**summary):
+    count("scraper_runs_total", status=summary["status"])
+    set_gauge("scraper_last_run_timestamp_seconds", time.time(), status=summary["status"])
+    http = connection_stats()
+    budget = call_budget({ws.id: ws.title for ws in [*sheets.values(), class_sheet]})
+    write_report(RUN_REPORT_FILE, **summary, http=http, sheets_budget=budget)
+    print(f"🔌 {http['requests']} Sheets requests over {http['connections_opened']} connections")
+    print_call_budget(budget)
 
-def extract_classes_held(roll):
+# === HELD-COUNT FINGERPRINT ===
+def load_fingerprint():
     try:
-        driver = webdriver.Chrome(options=chrome_options)
-        wait = WebDriverWait(driver, 10)
-        driver.get("https://exams-nnrg.in/")
-        wait.until(EC.presence_of_element_located((By.ID, "txtUserName"))).send_keys(roll)
-        driver.find_element(By.ID, "btnNext").click()
-        wait.until(EC.presence_of_element_located((By.ID, "txtPassword"))).send_keys(roll)
-        driver.find_element(By.ID, "btnSubmit").click()
-        wait.until(EC.presence_of_element_located((By.LINK_TEXT, "Click Here to go Student Dashbord"))).click()
-        wait.until(EC.presence_of_element_located((By.ID, "ctl00_cpStud_grdSubject")))
-        rows = driver.find_element(By.ID, "ctl00_cpStud_grdSubject").find_elements(By.TAG_NAME, "tr")[1:-1]
-        held = [r.find_elements(By.TAG_NAME, "td")[3].text.strip() or "0" for r in rows if len(r.find_elements(By.TAG_NAME, "td")) >= 4]
-        return held + ["0"] * (13 - len(held))
-    except:
-        return ["0"] * 13
-    finally:
-        try: driver.quit()
-        except: pass
+        with open(FINGERPRINT_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
 
-def process_roll(roll):
+def save_fingerprint(fingerprint):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(FINGERPRINT_FILE, "w") as f:
+        json.dump(fingerprint, f)
+
+# === RUN JOURNAL ===
+# Append-only record of a run (its column header, each roll's result, the publish plan and
+# each batch sent) so `--resume` can pick an interrupted run up where it stopped.
+def journal_path(run_id):
+    return os.path.join(JOURNAL_DIR, f"{run_id}.jsonl")
+
+def journal_append(run_id, event, /, **fields):
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    with open(journal_path(run_id), "a") as f:
+        f.write(json.dumps({"event": event, "at": time.time(), **fields}) + "\n")
+
+def prune_journals():
+    paths = sorted(glob.glob(os.path.join(JOURNAL_DIR, "*.jsonl")), key=os.path.getmtime)
+    for path in paths[:-JOURNAL_KEEP]:
+        os.remove(path)
+
+def load_unfinished_run():
+    paths = sorted(glob.glob(os.path.join(JOURNAL_DIR, "*.jsonl")), key=os.path.getmtime)
+    if not paths:
+        return None
+    state = {"results": {}}
+    with open(paths[-1]) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # half-written last line from the crash
+            event = entry["event"]
+            if event == "run_started":
+                state.update(run_id=entry["run_id"], timestamp=entry["timestamp"], started_at=entry["started_at"])
+            elif event == "roll_scraped":
+                state["results"][entry["result"]["roll"]] = entry["result"]
+            elif event == "run_finished":
+                return None
+    return state if "run_id" in state else None
+
+def fetch_roll(roll):
+    # Scrape stage: log in and keep the raw dashboard; parsing happens off the browser threads
     for attempt in range(1, MAX_ATTEMPTS + 1):
+        steps = {"roll": roll[:-1], "attempt": attempt}
+        driver = None
         try:
-            driver = webdriver.Chrome(options=chrome_options)
-            driver.set_page_load_timeout(10)
-            wait = WebDriverWait(driver, 5)
-            driver.get("https://exams-nnrg.in/")
-            wait.until(EC.presence_of_element_located((By.ID, "txtUserName"))).send_keys(roll)
-            driver.find_element(By.ID, "btnNext").click()
-            wait.until(EC.presence_of_element_located((By.ID, "txtPassword"))).send_keys(roll)
-            driver.find_element(By.ID, "btnSubmit").click()
-            wait.until(EC.presence_of_element_located((By.LINK_TEXT, "Click Here to go Student Dashbord"))).click()
-            wait.until(EC.presence_of_element_located((By.ID, "ctl00_cpStud_lblTotalPercentage")))
-
-            overall = driver.find_element(By.ID, "ctl00_cpStud_lblTotalPercentage").text.strip()
-            table = driver.find_element(By.ID, "ctl00_cpStud_grdSubject")
-            rows = table.find_elements(By.TAG_NAME, "tr")[1:]
-
-            percent_data = {"Overall %": overall}
-            attended_data = {}
-
-            for r in rows:
-                cols = r.find_elements(By.TAG_NAME, "td")
-                if len(cols) >= 6:
-                    subject = cols[1].text.upper().split(":")[0].strip()
-                    percent = cols[5].text.strip()
-                    attended = cols[4].text.strip()
-                    key = SUBJECT_ALIASES.get(subject)
-                    if key:
-                        if percent:
-                            percent_data[key] = percent
-                        if attended:
-                            attended_data[key] = attended
-
-            return (roll[:-1], percent_data, attended_data)
+            with span("driver launch", **steps):
+                driver = webdriver.Chrome(options=chrome_options)
+                add_gauge("scraper_live_browsers", 1)
+                driver.set_page_load_timeout(10)
+                wait = WebDriverWait(driver, 5)
+            with span("login: open portal", **steps):
+                driver.get("https://exams-nnrg.in/")
+            with span("login: username", **steps):
+                wait.until(EC.presence_of_element_located((By.ID, "txtUserName"))).send_keys(roll)
+                driver.find_element(By.ID, "btnNext").click()
+            with span("login: password", **steps):
+                wait.until(EC.presence_of_element_located((By.ID, "txtPassword"))).send_keys(roll)
+                driver.find_element(By.ID, "btnSubmit").click()
+            with span("login: dashboard", **steps):
+                wait.until(EC.presence_of_element_located((By.LINK_TEXT, "Click Here to go Student Dashbord"))).click()
+                wait.until(EC.presence_of_element_located((By.ID, "ctl00_cpStud_lblTotalPercentage")))
+
+            with span("capture page", **steps):
+                page = {
+                    "roll": roll,
+                    "overall": driver.find_element(By.ID, "ctl00_cpStud_lblTotalPercentage").text.strip(),
+                    "table": driver.find_element(By.ID, "ctl00_cpStud_grdSubject").get_attribute("outerHTML"),
+                    "scraped_at": datetime.now(ZoneInfo("Asia/Kolkata")).isoformat(),
+                }
+            count("scraper_login_attempts_total", outcome="ok")
+            count("scraper_rolls_total", result="scraped")
+            return page
         except:
+            count("scraper_login_attempts_total", outcome="error")
             time.sleep(0.5)
         finally:
-            try: driver.quit()
-            except: pass
-    return (roll[:-1], {}, {})
+            if driver is not None:
+                with span("driver quit", **steps):
+                    try: driver.quit()
+                    except: pass
+                add_gauge("scraper_live_browsers", -1)
+    count("scraper_rolls_total", result="failed")
+    return {"roll": roll, "overall": None, "table": None, "scraped_at": None}
+
+class TableRows(HTMLParser):
+    # Text of every <td>, row by row, whitespace collapsed the way WebElement.text does
+    def __init__(self):
+        super().__init__()
+        self.rows, self.cell = [], None
+
+    def close_cell(self):
+        if self.cell is not None:
+            self.rows[-1].append(" ".join("".join(self.cell).split()))
+            self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("tr", "td"):
+            self.close_cell()
+        if tag == "tr":
+            self.rows.append([])
+        elif tag == "td" and self.rows:
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "tr"):
+            self.close_cell()
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+def parse_page(page):
+    if page["table"] is None:
+        return {"roll": page["roll"][:-1], "percent": {}, "attended": {}, "held": {}, "held_column": [], "scraped_at": None}
+
+    table = TableRows()
+    table.feed(page["table"])
+    rows = table.rows[1:]
+
+    percent_data = {"Overall %": page["overall"]}
+    attended_data = {}
+    held_data = {}
+    held = []
+
+    for i, cols in enumerate(rows):
+        # Last row is the totals footer, it has no classes held of its own
+        if len(cols) >= 4 and i < len(rows) - 1:
+            held.append(cols[3] or "0")
+        if len(cols) >= 6:
+            subject = cols[1].upper().split(":")[0].strip()
+            percent = cols[5]
+            attended = cols[4]
+            key = SUBJECT_ALIASES.get(subject)
+            if key:
+                held_data[key] = cols[3]
+                if percent:
+                    percent_data[key] = percent
+                if attended:
+                    attended_data[key] = attended
+
+    return {
+        "roll": page["roll"][:-1],
+        "percent": percent_data,
+        "attended": attended_data,
+        "held": held_data,
+        "held_column": held + ["0"] * (13 - len(held)),
+        "scraped_at": page["scraped_at"],
+    }
+
+def process_roll(roll):
+    page = fetch_roll(roll)
+    with span("parse", roll=roll[:-1]):
+        return parse_page(page)
+
+def attendance_records(result):
+    # One row per subject the roll has any figure for, ready for the attendance store
+    subjects = set(result["percent"]) | set(result["attended"]) | set(result["held"])
+    return [
+        (result["roll"], subject, result["held"].get(subject), result["attended"].get(subject),
+         result["percent"].get(subject), result["scraped_at"])
+        for subject in sorted(subjects)
+    ]
 
 # === MAIN ===
-def run_fast_scraper():
-    global client
-    rolls = generate_roll_numbers()
-    roll_map = {s: get_roll_row_mapping(sheets[s]) for s in SUBJECT_SHEETS}
-    col_index = {s: prepare_new_column(sheets[s]) for s in SUBJECT_SHEETS}
-    batched_data = {s: [] for s in SUBJECT_SHEETS}
-    attended_data_per_subject = {s: [] for s in SUBJECT_ClassesAttended_RANGES}
-
-    print("⏳ Scraping class held...")
-    class_72 = extract_classes_held(rolls[0])
-    class_a8 = extract_classes_held("237Z1A05A8P")
-    safe_call(class_sheet.update, "D8:D20", [[v] for v in class_72])
-    safe_call(class_sheet.update, "J8:J20", [[v] for v in class_a8])
-    print("✅ Inserted class held.")
-
-    print("🧹 Clearing old classes attended data...")
-    for subject, cell_range in SUBJECT_ClassesAttended_RANGES.items():
-        safe_call(class_sheet.update, cell_range, [[""] for _ in range(65)])
-
-    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        futures = {executor.submit(process_roll, r): r for r in rolls}
-        for f in as_completed(futures):
-            roll, percent_data, attended_data = f.result()
-            for subject, val in percent_data.items():
-                if roll in roll_map.get(subject, {}):
-                    row = roll_map[subject][roll]
-                    col = col_index[subject]
-                    batched_data[subject].append((row, col, val if subject == "Overall %" else val + " %"))
-
-            for subject, val in attended_data.items():
-                if subject in SUBJECT_ClassesAttended_RANGES:
-                    if roll in roll_map.get(subject, {}):
-                        row = roll_map[subject][roll]
-                        attended_data_per_subject[subject].append((row, val))
-
-    print("📝 Writing scraped percentage data...")
-    for subject, updates in batched_data.items():
-        if not updates:
+def chunk_header_sheets(chunk, run_id):
+    # Subject sheets whose run header this chunk writes
+    ids = {sheets[s].id: s for s in SUBJECT_SHEETS}
+    return {
+        ids[r["updateCells"]["start"]["sheetId"]] for r in chunk
+        if "start" in r.get("updateCells", {}) and run_tag(run_id) in json.dumps(r["updateCells"]["rows"])
+    }
+
+def send_chunk(run_id, chunk, verify):
+    # batchUpdate is atomic, so if this chunk's run headers are already on the sheet a previous
+    # attempt went through server-side and sending it again would insert duplicate columns
+    headers = chunk_header_sheets(chunk, run_id)
+    attempts = []
+
+    def attempt():
+        if headers and (verify or attempts) and headers & applied_run_tags(run_id):
+            print("♻️ Batch already applied by an earlier attempt, not resending")
+            return None
+        attempts.append(1)
+        return spreadsheet.batch_update({"requests": chunk})
+
+    return safe_call(attempt)
+
+# === PUBLISH QUEUE ===
+# Planned batches are written to a durable queue in the attendance store and drained by a
+# publisher thread, so a throttled Sheets API never holds up the portal scrape. A flush is
+# one cross-sheet batch; batches sharing a worksheet go out in queue order, and only
+# batches on disjoint worksheets (oversized splits, older backlog) are sent side by side.
+# Whatever a run could not send is flushed by the next run or by `scraper13.2.py publish`.
+def publish_lane(items, stop=None):
+    # Stops at the first temporary failure, or when asked to: the rest of this lane's batches wait
+    # for the retry. A batch Sheets rejects outright is moved to 'failed' and the lane goes on.
+    for item in items:
+        if stop and stop.is_set():
+            return False
+        label = f"batch {item['seq'] + 1} of run {item['run_id']}"
+        rejected = failed_items(item["run_id"])
+        if rejected:
+            # Its columns or headers may never have been made; writing the rest could land in the wrong place
+            mark_failed(item["id"], f"skipped: batch {rejected[0]['batch']} of this run was rejected")
+            print(f"⏭️ Skipped {label}: an earlier batch of the run was rejected")
             continue
-        rows = list(set(row for row, col, val in updates))
-        min_row, max_row = min(rows), max(rows)
-        col = col_index[subject]
-        cell_range = f"{chr(64 + col)}{min_row}:{chr(64 + col)}{max_row}"
-        cell_objs = safe_call(sheets[subject].range, cell_range)
-        cell_map = {(cell.row, cell.col): cell for cell in cell_objs}
-        for row, col, val in updates:
-            if (row, col) in cell_map:
-                cell_map[(row, col)].value = val
-        safe_call(sheets[subject].update_cells, list(cell_map.values()))
-        print(f"✅ {subject} updated")
-
-    print("📝 Writing classes attended data...")
-    for subject, updates in attended_data_per_subject.items():
-        if not updates:
+        # Counted before sending: a batch tried before may have landed without us hearing back
+        mark_attempt(item["id"])
+        start = time.time()
+        try:
+            send_chunk(item["run_id"], item["chunk"], verify=item["attempts"] > 0)
+        except Exception as e:
+            # No HTTP status (credentials exhausted, network, auth) or 429/5xx: worth another try
+            if error_status(e) is None or is_retryable(e):
+                print(f"⚠️ Publishing {label} failed: {e}")
+                return False
+            mark_failed(item["id"], f"{type(e).__name__}: {e}")
+            count("scraper_publish_failed_total")
+            print(f"❌ Sheets rejected {label}, moved to failed: {e}")
             continue
-        updates.sort()
-        cell_range = SUBJECT_ClassesAttended_RANGES[subject]
-        values = [[v] for _, v in updates]
-        safe_call(class_sheet.update, cell_range, values)
-        print(f"✅ {subject} classes attended updated")
+        mark_sent(item["id"], datetime.now(ZoneInfo("Asia/Kolkata")).isoformat())
+        count_stage("publish", time.time() - start)
+        if os.path.exists(journal_path(item["run_id"])):
+            journal_append(item["run_id"], "batch_published", batch=item["seq"])
+        print(f"✅ Published batch {item['seq'] + 1} of run {item['run_id']} ({len(item['chunk'])} requests)")
+    return True
+
+def drain_publish_queue(timeout=None, stop=None):
+    deadline = time.time() + timeout if timeout is not None else None
+    stop = stop or threading.Event()
+    with DRAIN_LOCK:
+        while not stop.is_set():
+            items = pending_items()
+            if not items:
+                return True
+            if deadline and time.time() > deadline:
+                print(f"⏸️ {len(items)} batches left in the publish queue")
+                return False
+            lanes = sheet_lanes(items, lambda item: item["chunk"])
+            with ThreadPoolExecutor(max_workers=min(PUBLISH_THREADS, len(lanes)), thread_name_prefix="publish") as executor:
+                sent = all(list(executor.map(lambda lane: publish_lane(lane, stop), lanes)))
+            if not sent and not stop.is_set():
+                print(f"⏳ Retrying in {PUBLISH_RETRY_WAIT}s...")
+                with span("429 wait"):
+                    stop.wait(PUBLISH_RETRY_WAIT)
+        return False
+
+def stop_publisher(publisher, stop, timeout):
+    # Waits up to timeout, then has the publisher stop after the batches in flight, so it is
+    # never still draining when the next run (or `serve` iteration) starts
+    publisher.join(timeout)
+    if publisher.is_alive():
+        stop.set()
+        publisher.join()
+
+def run_publisher(timeout):
+    stop = threading.Event()
+    publisher = threading.Thread(target=drain_publish_queue, args=(timeout, stop), name="publisher", daemon=True)
+    publisher.start()
+    stop_publisher(publisher, stop, timeout)
+    return pending_count() == 0
+
+# === PIPELINE ===
+# scrape workers → raw pages → parser → results → aggregator → publish queue → publisher.
+# The in-memory queues are bounded, so a stage that falls behind holds the ones before it
+# back instead of letting pages pile up, and the aggregator flushes every few rolls so the
+# sheets fill in while the rest of the class is still being scraped.
+def count_stage(name, busy, items=1, depth=None):
+    with STAGE_LOCK:
+        stats = STAGE_STATS.setdefault(name, {"items": 0, "busy_seconds": 0.0, "max_queue_depth": 0})
+        stats["items"] += items
+        stats["busy_seconds"] += busy
+        if depth is not None:
+            stats["max_queue_depth"] = max(stats["max_queue_depth"], depth)
+    if depth is not None:
+        set_gauge("scraper_queue_depth", depth, stage=name)
+
+def stage_summary():
+    with STAGE_LOCK:
+        return {
+            name: {**stats, "busy_seconds": round(stats["busy_seconds"], 3),
+                   "items_per_second": round(stats["items"] / stats["busy_seconds"], 2) if stats["busy_seconds"] else None}
+            for name, stats in STAGE_STATS.items()
+        }
+
+def stage_put(q, item, stop):
+    # Blocks while the next stage is behind; gives up once the pipeline is stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def stage_get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=1)
+        except queue.Empty:
+            pass
+    return None
+
+def scrape_stage(rolls, raw_pages, stop):
+    def work(roll):
+        if stop.is_set():
+            return
+        start = time.time()
+        page = fetch_roll(roll)
+        count_stage("scrape", time.time() - start)
+        stage_put(raw_pages, page, stop)
+        count_stage("scrape", 0, items=0, depth=raw_pages.qsize())
+
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="scrape") as executor:
+            list(executor.map(work, rolls))
+    finally:
+        stage_put(raw_pages, None, stop)
+
+def parse_stage(run_id, raw_pages, results, parsed, stop):
+    # Results already parsed (reference rolls, or rolls from a resumed journal) go first
+    try:
+        for result in parsed:
+            stage_put(results, result, stop)
+        while (page := stage_get(raw_pages, stop)) is not None:
+            start = time.time()
+            with span("parse", roll=page["roll"][:-1]):
+                result = parse_page(page)
+            journal_append(run_id, "roll_scraped", result=result)
+            count_stage("parse", time.time() - start)
+            stage_put(results, result, stop)
+            count_stage("parse", 0, items=0, depth=results.qsize())
+    finally:
+        stage_put(results, None, stop)
+
+def publish_stage(prep_future, wake, closed, stop):
+    # Starts once sheet prep has flushed older backlog, so only one thread ever drains the queue
+    if prep_future.exception() is not None:
+        return
+    while not stop.is_set():
+        drain_publish_queue(stop=stop)
+        if closed.is_set() and not pending_count():
+            return
+        wake.wait(AGGREGATE_INTERVAL)
+        wake.clear()
+
+def aggregate_stage(run_id, header, results, prep_future, wake):
+    published = load_published()
+    layout = None
+    target_cols = None
+    pending = []
+    seen_rolls = set()
+    held_by_roll = {}
+    failed_rolls = []
+    last_flush = time.time()
+
+    def flush(batch, final=False):
+        nonlocal target_cols
+        start = time.time()
+        roll_map, class_roll_map, last_cols, run_cols = layout
+        save_attendance(run_id, [record for r in batch for record in attendance_records(r)])
+
+        cells = {}
+        for result in batch:
+            seen_rolls.add(result["roll"])
+            cells.update(subject_cells(roll_map, result))
+            cells.update(attended_cells(class_roll_map, result["roll"], result["attended"]))
+        if final:
+            # Rows on the sheets that no scraped roll claimed are cleared like any other gap
+            for subject in SUBJECT_SHEETS:
+                for roll, row in roll_map[subject].items():
+                    if roll not in seen_rolls:
+                        cells[(subject, row, RUN_COL)] = ""
+            for roll in class_roll_map:
+                if roll not in seen_rolls:
+                    cells.update(attended_cells(class_roll_map, roll, {}))
+            cells.update(held_cells(held_blocks(held_by_roll)))
+
+        changed = {key: value for key, value in cells.items() if published.get(key) != value}
+        requests = []
+        if target_cols is None:
+            with span("column prep"):
+                requests, target_cols = structural_requests(header, published, last_cols, run_cols)
+        requests += value_requests(changed, target_cols)
+        if requests:
+            # One cross-sheet batchUpdate per flush, split only when the payload is too big
+            chunks = chunk_requests(requests)
+            with span("queue publish", batches=len(chunks), cells=len(changed)):
+                enqueue_publish(run_id, chunks, datetime.now(ZoneInfo("Asia/Kolkata")).isoformat())
+            journal_append(run_id, "publish_queued", batches=len(chunks), cells=len(changed))
+            # Each sheet's batches drain in order, so the snapshot already describes the sheets once they have
+            save_published(changed)
+            published.update(changed)
+            wake.set()
+        count_stage("aggregate", time.time() - start, items=len(batch), depth=pending_count())
+
+    while True:
+        try:
+            result = results.get(timeout=AGGREGATE_INTERVAL)
+        except queue.Empty:
+            result = False
+        if result is None:
+            break
+        if result:
+            pending.append(result)
+            held_by_roll[result["roll"]] = result["held_column"]
+            if not result["percent"]:
+                failed_rolls.append(result["roll"])
+        if layout is None and prep_future.done() and prep_future.exception() is None:
+            layout = prep_future.result()
+        due = len(pending) >= AGGREGATE_BATCH or (pending and time.time() - last_flush >= AGGREGATE_INTERVAL)
+        if layout and due:
+            flush(pending)
+            pending, last_flush = [], time.time()
+
+    if layout is None:
+        with span("wait for sheet prep"):
+            try:
+                layout = prep_future.result()
+            except Exception:
+                # Results are journaled and stored; a later --resume publishes them
+                save_attendance(run_id, [record for r in pending for record in attendance_records(r)])
+                raise
+    flush(pending, final=True)
+    return failed_rolls, held_by_roll
+
+def held_blocks(held_by_roll):
+    # First section is the numbered rolls (72-99), second the lettered ones (A0-D9)
+    rolls = generate_roll_numbers()
+    sections = [[r[:-1] for r in rolls if r[len(BASE_PREFIX)].isdigit()],
+                [r[:-1] for r in rolls if not r[len(BASE_PREFIX)].isdigit()]]
+    return {
+        cell_range: section_held(held_by_roll, reference[:-1], section_rolls)
+        for (cell_range, reference), section_rolls in zip(HELD_RANGES.items(), sections)
+    }
+
+def run_pipeline(run_id, header, rolls, parsed):
+    raw_pages = queue.Queue(maxsize=MAX_THREADS * 2)
+    results = queue.Queue(maxsize=AGGREGATE_BATCH * 2)
+    wake, closed, stop = threading.Event(), threading.Event(), threading.Event()
+
+    # Sheet preparation overlaps the scrape; only the aggregator waits for it.
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheet-prep") as prep_executor:
+        prep_future = prep_executor.submit(prepare_sheets, run_id)
+        stages = [
+            threading.Thread(target=scrape_stage, args=(rolls, raw_pages, stop), name="scrape-feeder", daemon=True),
+            threading.Thread(target=parse_stage, args=(run_id, raw_pages, results, parsed, stop), name="parser", daemon=True),
+        ]
+        publisher = threading.Thread(target=publish_stage, args=(prep_future, wake, closed, stop), name="publisher", daemon=True)
+        for thread in stages + [publisher]:
+            thread.start()
+        try:
+            with span("pipeline"):
+                failed_rolls, held_by_roll = aggregate_stage(run_id, header, results, prep_future, wake)
+        except BaseException:
+            # Unblocks the scrape and parse threads and stops publishing; what was scraped is journaled
+            stop.set()
+            wake.set()
+            raise
+        finally:
+            for thread in stages:
+                thread.join()
+            if stop.is_set():
+                publisher.join()
+
+    closed.set()
+    wake.set()
+    with span("publish backlog"):
+        stop_publisher(publisher, stop, PUBLISH_TIMEOUT)
+    return failed_rolls, held_by_roll, pending_count() == 0
+
+def run_fast_scraper(force=False, resume=False):
+    rolls = generate_roll_numbers()
+    state = load_unfinished_run() if resume else None
+    if resume and not state:
+        print("ℹ️ No interrupted run to resume, starting a new one.")
+
+    if state:
+        # Rolls that failed last time are retried along with the ones never reached; the run
+        # tag and the published snapshot keep already-sent cells from going out twice
+        run_id, timestamp = state["run_id"], state["timestamp"]
+        print(f"⏯️ Resuming run {run_id}: {len(state['results'])} rolls in the journal")
+        results = [r for r in state["results"].values() if r["percent"]]
+        fingerprint = {r["roll"]: r["held_column"] for r in results if r["roll"] + "P" in REFERENCE_ROLLS}
+        fingerprint_valid = len(fingerprint) == len(REFERENCE_ROLLS)
+        start_run(run_id, state["started_at"])
+    else:
+        started = datetime.now(ZoneInfo("Asia/Kolkata"))
+        timestamp = started.strftime("%Y-%m-%d %I:%M %p")
+        run_id = RUN_ID or started.strftime("%Y%m%dT%H%M%S")
+
+        with span("reference rolls"):
+            print("⏳ Scraping reference rolls...")
+            with ThreadPoolExecutor(max_workers=len(REFERENCE_ROLLS)) as executor:
+                results = list(executor.map(process_roll, REFERENCE_ROLLS))
+
+        # A reference roll that failed to scrape has no held column; never trust that as a fingerprint
+        fingerprint = {r["roll"]: r["held_column"] for r in results}
+        fingerprint_valid = all(fingerprint.values())
+        if fingerprint_valid and not force and fingerprint == load_fingerprint():
+            print("⏭️ Classes held unchanged since last run. Skipping scrape.")
+            if pending_count():
+                with span("publish"):
+                    run_publisher(PUBLISH_TIMEOUT)
+            write_run_report(status="skipped")
+            return
+
+        start_run(run_id, started.isoformat())
+        journal_append(run_id, "run_started", run_id=run_id, timestamp=timestamp, started_at=started.isoformat())
+        for result in results:
+            journal_append(run_id, "roll_scraped", result=result)
+
+    # The reference rolls (or the journal's rolls) are already parsed, they enter the pipeline as they are
+    done = {r["roll"] + "P" for r in results}
+    failed_rolls, held_by_roll, published = run_pipeline(
+        run_id, run_header(timestamp, run_id), [r for r in rolls if r not in done], results)
+    rejected = failed_items(run_id)
+    if rejected:
+        # Flushes after the rejection still saved their cells; none of this run's can be trusted
+        clear_published()
+        print(f"❌ Sheets rejected {len(rejected)} batches of this run, the next run republishes every cell. "
+              f"First error: {rejected[0]['error']}")
+    elif published:
+        print("✅ Published run")
+    else:
+        print(f"⏸️ {pending_count()} batches still queued (Sheets throttled or unreachable); "
+              "the next run or `publish` sends them")
+
+    # Only remember the fingerprint once every roll made it onto the sheets, otherwise
+    # the next run would skip past the gaps left by this one.
+    if fingerprint_valid and not failed_rolls and published and not rejected:
+        save_fingerprint(fingerprint)
+    elif failed_rolls:
+        print(f"⚠️ {len(failed_rolls)} rolls failed, fingerprint not saved: {failed_rolls}")
+    elif fingerprint_valid:
+        print("⚠️ Run not fully published, fingerprint not saved")
+
+    journal_append(run_id, "run_finished")
+    prune_journals()
+    # "queued" until the publisher sends the run's last batch, then "completed"
+    status = "publish_failed" if rejected else "completed" if published else "queued"
+    finish_run(run_id, datetime.now(ZoneInfo("Asia/Kolkata")).isoformat(), status)
+    write_run_report(status=status, run_id=run_id, rolls=len(rolls),
+                     failed_rolls=failed_rolls, failed_batches=rejected, stages=stage_summary())
+
+# === SERVICE MODE ===
+# Runs back to back on a timer with a local /metrics endpoint for Prometheus, so portal
+# slowdowns and quota exhaustion can be alerted on instead of read out of job logs.
+def serve(interval, port, trace_path=None):
+    serve_metrics(port)
+    watch("scraper_publish_queue_pending", pending_count)
+    watch("scraper_http_connections_total", lambda: connection_stats()["connections_opened"], state="new")
+    watch("scraper_http_connections_total", lambda: connection_stats()["connections_reused"], state="reused")
+    while True:
+        reset_spans()
+        reset_calls()
+        with STAGE_LOCK:
+            STAGE_STATS.clear()
+        try:
+            run_fast_scraper()
+        except Exception as e:
+            count("scraper_runs_total", status="error")
+            print(f"❌ Run failed: {e}")
+        write_trace(trace_path)
+        print(f"💤 Next run in {interval}s")
+        time.sleep(interval)
 
 if __name__ == "__main__":
-    run_fast_scraper()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "publish", "migrate-layout", "serve"])
+    parser.add_argument("--force", action="store_true", help="scrape even if classes held are unchanged")
+    parser.add_argument("--resume", action="store_true", help="finish the last interrupted run instead of starting over")
+    parser.add_argument("--trace", metavar="PATH", help="also write the run as a Chrome trace-event file (or set TRACE_FILE)")
+    parser.add_argument("--interval", type=int, default=SERVE_INTERVAL, help="serve: seconds between runs")
+    parser.add_argument("--metrics-port", type=int, help="serve: port for /metrics (or set METRICS_PORT)")
+    args = parser.parse_args()
+    try:
+        if args.command == "serve":
+            serve(args.interval, args.metrics_port, args.trace)
+        elif args.command == "migrate-layout":
+            migrate_to_append_layout()
+        elif args.command == "publish":
+            drain_publish_queue()
+            rejected = failed_items()
+            print("✅ Publish queue is empty." if not rejected
+                  else f"⚠️ Publish queue is empty; {len(rejected)} batches were rejected by Sheets: {rejected}")
+        else:
+            run_fast_scraper(force=args.force, resume=args.resume)
+    finally:
+        write_trace(args.trace)
@@ -2,12 +2,14 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from oauth2client.service_account import ServiceAccountCredentials
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from shutil import which
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import gspread
+from sheets_common import (
+    authorize, cached_credentials, insert_column_request, update_cells_request, section_held, call_budget, print_call_budget
+)
 import time
 import os
 import json
@@ -20,6 +22,12 @@ BASE_PREFIX = "237Z1A05"
 CREDENTIAL_FILES = [f"credentials{i}.json" for i in range(1, 15)]
 CURRENT_CRED_INDEX = 0
 RATE_LIMIT_WAIT = 60  # Seconds to wait before retrying after rate limit
+NEW_COLUMN = 3  # each run's column goes in at C, right after Name
+# Tags this run's column header, so a retry (or a re-run of the same workflow run) finds the
+# column it already inserted instead of inserting another one
+RUN_ID = os.environ.get("RUN_ID") or (f"gh{os.environ['GITHUB_RUN_ID']}" if os.environ.get("GITHUB_RUN_ID") else "")
+RUN_ID = RUN_ID or datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%Y%m%dT%H%M%S")
+RUN_TAG = f"[{RUN_ID}]"
 
 SUBJECT_SHEETS = [
     "Overall %", "CN", "DEVOPS", "PPL", "NLP", "DAA",
@@ -41,8 +49,8 @@ scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/au
 def get_gspread_client(cred_file):
     if not os.path.exists(cred_file):
         raise FileNotFoundError(f"Credential file {cred_file} not found")
-    creds = ServiceAccountCredentials.from_json_keyfile_name(cred_file, scope)
-    return gspread.authorize(creds)
+    creds = cached_credentials(cred_file, scope)
+    return authorize(creds)
 
 def switch_credentials():
     global CURRENT_CRED_INDEX
@@ -80,8 +88,9 @@ class_sheet = client.open_by_key(SHEET_ID).worksheet("Attendence CSE-B(2023-27)"
 # === CLEAR RANGES IN CLASS SHEET ===
 def clear_attendance_sheet():
     global client, sheets, class_sheet
+    # D8:D20 and J8:J20 are not cleared: they are only rewritten after the full scrape
     ranges = [
-        "D8:D20", "J8:J20", "F27:F91", "H27:H91", "J27:J91", "L27:L91",
+        "F27:F91", "H27:H91", "J27:J91", "L27:L91",
         "N27:N91", "P27:P91", "R27:R91", "T27:T91", "V27:V91", "X27:X91",
         "Z27:Z91", "AB27:AB91", "AD27:AD91"
     ]
@@ -106,21 +115,30 @@ def generate_roll_numbers():
     return rolls
 
 # === ADD COLUMN ===
-def prepare_new_column(sheet):
+def prepare_new_column(subject):
+    # Looked up by name on every attempt, so a retry after a credential switch uses the new client
     global client, sheets, class_sheet
-    ist_time = datetime.now(ZoneInfo("Asia/Kolkata"))
-    timestamp = ist_time.strftime("%Y-%m-%d %I:%M %p")
+    timestamp = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%Y-%m-%d %I:%M %p")
     try:
-        sheet.insert_cols([[]], 3)
-        sheet.update_cell(10, 3, timestamp)
-        return 3
+        sheet = sheets[subject]
+        header = sheet.row_values(10)
+        existing = [i for i, v in enumerate(header, start=1) if RUN_TAG in v]
+        if existing:
+            print(f"♻️ {subject}: run {RUN_ID} already has column {existing[-1]}, reusing it")
+            return existing[-1]
+        # Insert and header in one batchUpdate: either both landed or neither did
+        sheet.spreadsheet.batch_update({"requests": [
+            insert_column_request(sheet.id, NEW_COLUMN),
+            update_cells_request(sheet.id, 10, NEW_COLUMN, [[f"{timestamp} {RUN_TAG}"]]),
+        ]})
+        return NEW_COLUMN
     except gspread.exceptions.APIError as e:
         if e.response.status_code == 429:
             print("⚠️ Rate limit hit, switching credentials...")
             client = switch_credentials()
             sheets = {name: client.open_by_key(SHEET_ID).worksheet(name) for name in SUBJECT_SHEETS}
             class_sheet = client.open_by_key(SHEET_ID).worksheet("Attendence CSE-B(2023-27)")
-            return prepare_new_column(sheet)  # Retry
+            return prepare_new_column(subject)  # Retry; finds the column if the insert went through
         else:
             raise e
 
@@ -140,34 +158,24 @@ def get_roll_row_mapping(sheet):
         else:
             raise e
 
-# === CLASSES HELD FOR ONE ROLL ===
-def extract_classes_held(rollP):
-    driver = webdriver.Chrome(options=chrome_options)
-    wait = WebDriverWait(driver, 10)
+# === CLASSES HELD BLOCKS ===
+# Filled from the results of the main scrape: 72 feeds D8:D20 and A8 feeds J8:J20.
+# If a reference roll failed, the held column most of its section agrees on is used instead.
+def update_classes_held(cell_range, held, source):
+    global client, sheets, class_sheet
     try:
-        driver.get("https://exams-nnrg.in/BeeSERP/Login.aspx")
-        wait.until(EC.presence_of_element_located((By.ID, "txtUserName"))).send_keys(rollP)
-        driver.find_element(By.ID, "btnNext").click()
-        wait.until(EC.presence_of_element_located((By.ID, "txtPassword"))).send_keys(rollP)
-        driver.find_element(By.ID, "btnSubmit").click()
-        wait.until(EC.presence_of_element_located((By.LINK_TEXT, "Click Here to go Student Dashbord"))).click()
-        wait.until(EC.presence_of_element_located((By.ID, "ctl00_cpStud_grdSubject")))
-
-        rows = driver.find_element(By.ID, "ctl00_cpStud_grdSubject").find_elements(By.TAG_NAME, "tr")[1:-1]
-        held = []
-        for r in rows:
-            cols = r.find_elements(By.TAG_NAME, "td")
-            if len(cols) >= 4:
-                held.append(cols[3].text.strip() or "0")
-        return held + ["0"] * (13 - len(held))
-    except Exception as e:
-        print(f"❌ Error fetching classes held for {rollP}: {e}")
-        return ["0"] * 13
-    finally:
-        try:
-            driver.quit()
-        except:
-            pass
+        class_sheet.update(cell_range, [[v] for v in held])
+        print(f"✅ Inserted Classes Held from {source} into {cell_range}")
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code == 429:
+            print("⚠️ Rate limit hit, switching credentials...")
+            client = switch_credentials()
+            sheets = {name: client.open_by_key(SHEET_ID).worksheet(name) for name in SUBJECT_SHEETS}
+            class_sheet = client.open_by_key(SHEET_ID).worksheet("Attendence CSE-B(2023-27)")
+            class_sheet.update(cell_range, [[v] for v in held])
+            print(f"✅ Inserted Classes Held from {source} into {cell_range}")
+        else:
+            raise e
 
 # === SCRAPE ONE ROLL ===
 def process_roll(rollP):
@@ -189,8 +197,12 @@ def process_roll(rollP):
             table = driver.find_element(By.ID, "ctl00_cpStud_grdSubject")
             rows = table.find_elements(By.TAG_NAME, "tr")[1:]
             data = {"Overall %": overall}
-            for r in rows:
+            held = []
+            for i, r in enumerate(rows):
                 cols = r.find_elements(By.TAG_NAME, "td")
+                # Last row is the totals footer, it has no classes held of its own
+                if len(cols) >= 4 and i < len(rows) - 1:
+                    held.append(cols[3].text.strip() or "0")
                 if len(cols) < 6:
                     continue
                 subject = cols[1].text.upper().split(":")[0].strip()
@@ -198,7 +210,7 @@ def process_roll(rollP):
                 key = SUBJECT_ALIASES.get(subject)
                 if key and percent and percent != "&nbsp;":
                     data[key] = percent
-            return (rollP[:-1], data)
+            return (rollP[:-1], data, held + ["0"] * (13 - len(held)))
         except Exception as e:
             print(f"⚠️ Attempt {attempt} failed for {rollP} — {e}")
             time.sleep(0.5)
@@ -208,7 +220,7 @@ def process_roll(rollP):
             except:
                 pass
     print(f"❌ Failed to scrape {rollP}")
-    return (rollP[:-1], {})
+    return (rollP[:-1], {}, [])
 
 # === CHROME OPTIONS ===
 chrome_options = webdriver.ChromeOptions()
@@ -229,44 +241,15 @@ def run_parallel_scraping():
     rolls = generate_roll_numbers()
     roll_with_p = [r + "P" for r in rolls]
     roll_to_row = {s: get_roll_row_mapping(sheets[s]) for s in SUBJECT_SHEETS}
-    col_index = {s: prepare_new_column(sheets[s]) for s in SUBJECT_SHEETS}
-
-    # → Classes Held for 1st roll
-    held_72 = extract_classes_held(roll_with_p[0])
-    try:
-        class_sheet.update("D8:D20", [[v] for v in held_72])
-        print("✅ Inserted Classes Held from 72 into D8:D20")
-    except gspread.exceptions.APIError as e:
-        if e.response.status_code == 429:
-            print("⚠️ Rate limit hit, switching credentials...")
-            client = switch_credentials()
-            sheets = {name: client.open_by_key(SHEET_ID).worksheet(name) for name in SUBJECT_SHEETS}
-            class_sheet = client.open_by_key(SHEET_ID).worksheet("Attendence CSE-B(2023-27)")
-            class_sheet.update("D8:D20", [[v] for v in held_72])
-            print("✅ Inserted Classes Held from 72 into D8:D20")
-        else:
-            raise e
+    col_index = {s: prepare_new_column(s) for s in SUBJECT_SHEETS}
 
-    # → Classes Held for 237Z1A05A8
-    held_a8 = extract_classes_held("237Z1A05A8P")
-    try:
-        class_sheet.update("J8:J20", [[v] for v in held_a8])
-        print("✅ Inserted Classes Held from A8 into J8:J20")
-    except gspread.exceptions.APIError as e:
-        if e.response.status_code == 429:
-            print("⚠️ Rate limit hit, switching credentials...")
-            client = switch_credentials()
-            sheets = {name: client.open_by_key(SHEET_ID).worksheet(name) for name in SUBJECT_SHEETS}
-            class_sheet = client.open_by_key(SHEET_ID).worksheet("Attendence CSE-B(2023-27)")
-            class_sheet.update("J8:J20", [[v] for v in held_a8])
-            print("✅ Inserted Classes Held from A8 into J8:J20")
-        else:
-            raise e
+    held_by_roll = {}
 
     with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
         futures = {executor.submit(process_roll, r): r for r in roll_with_p}
         for f in as_completed(futures):
-            roll, data = f.result()
+            roll, data, held = f.result()
+            held_by_roll[roll] = held
             if not data:
                 continue
             for subject, val in data.items():
@@ -290,5 +273,14 @@ def run_parallel_scraping():
                 else:
                     print(f"⚠️ Roll {roll} not found in sheet: {subject}")
 
+    # → Classes Held for 72 (numbered rolls) and A8 (lettered rolls)
+    held_72 = section_held(held_by_roll, rolls[0], [r for r in rolls if r[len(BASE_PREFIX)].isdigit()])
+    update_classes_held("D8:D20", held_72, "72")
+    held_a8 = section_held(held_by_roll, BASE_PREFIX + "A8", [r for r in rolls if not r[len(BASE_PREFIX)].isdigit()])
+    update_classes_held("J8:J20", held_a8, "A8")
+
 if __name__ == "__main__":
-    run_parallel_scraping()
\ No newline at end of file
+    try:
+        run_parallel_scraping()
+    finally:
+        print_call_budget(call_budget({ws.id: ws.title for ws in [*sheets.values(), class_sheet]}))
\ No newline at end of file
@@ -0,0 +1,587 @@
+import os
+import re
+import json
+import time
+import fcntl
+import math
+import threading
+from urllib.parse import unquote
+from datetime import datetime, timezone
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from google.auth.exceptions import GoogleAuthError
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+import gspread
+from gspread.http_client import HTTPClient
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as TransportError, Timeout
+from run_metrics import span, count
+
+# === CONFIG ===
+# Sheets rejects oversized batchUpdate bodies; stay well under the documented limit
+MAX_PAYLOAD_BYTES = 2_000_000
+SEND_THREADS = 8  # worksheets written at once by send_chunks
+CHUNK_RETRIES = 3
+CHUNK_RETRY_WAIT = 5  # seconds, grows with each retry
+PERCENT_FORMAT = {"type": "PERCENT", "pattern": "0.00%"}
+TOKEN_CACHE_FILE = os.path.join(".scraper_state", "token_cache.json")  # bearer tokens: kept out of the CI state cache
+TOKEN_REFRESH_MARGIN = 300  # seconds a cached token must still be good for to be reused
+CREDENTIAL_HEALTH_FILE = os.path.join(".scraper_state", "credential_health.json")
+THROTTLE_MEMORY = 3600  # seconds a 429 keeps counting against a key
+QUOTA_WINDOW = 60  # Sheets quotas refill per minute
+READ_QUOTA_PER_MINUTE = 60  # per-user read requests per minute
+WRITE_QUOTA_PER_MINUTE = 60  # per-user write requests per minute
+# Shared by every script on this machine, whichever key it uses; kept under the
+# per-project limit of 300 a minute so parallel jobs leave headroom
+SHEETS_QUOTA_FILE = os.path.join(".scraper_state", "sheets_quota.json")
+QUOTA_LIMITS = {
+    "read": int(os.environ.get("SHEETS_READS_PER_MINUTE", "240")),
+    "write": int(os.environ.get("SHEETS_WRITES_PER_MINUTE", "240")),
+}
+
+# === OAUTH TOKEN CACHE ===
+# Access tokens live on disk keyed by service account email and scopes, so credential
+# switches and scripts running side by side reuse a token until it nears expiry instead
+# of each signing a JWT and exchanging it. A concurrent refresh of the same key waits for
+# the one in flight and picks up its token.
+@contextmanager
+def locked_file(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def read_token_cache():
+    try:
+        with open(TOKEN_CACHE_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def write_token_cache(cache):
+    tmp = TOKEN_CACHE_FILE + ".tmp"
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, TOKEN_CACHE_FILE)
+
+class CachedCredentials(service_account.Credentials):
+    def cache_key(self):
+        return f"{self.service_account_email} {' '.join(sorted(self.scopes or []))}"
+
+    def refresh(self, request):
+        # Locked per key, so different keys still refresh in parallel
+        with locked_file(f"{TOKEN_CACHE_FILE}.{self.service_account_email}"):
+            entry = read_token_cache().get(self.cache_key())
+            # A token equal to the one we hold is the one being refreshed (expired or rejected)
+            if entry and entry["token"] != self.token and entry["expiry"] - time.time() > TOKEN_REFRESH_MARGIN:
+                self.token = entry["token"]
+                self.expiry = datetime.fromtimestamp(entry["expiry"], timezone.utc).replace(tzinfo=None)
+                return
+            super().refresh(request)
+            with locked_file(TOKEN_CACHE_FILE):
+                cache = {key: e for key, e in read_token_cache().items() if e["expiry"] > time.time()}
+                cache[self.cache_key()] = {"token": self.token, "expiry": self.expiry.replace(tzinfo=timezone.utc).timestamp()}
+                write_token_cache(cache)
+
+def cached_credentials(cred_file, scopes):
+    # Drop-in for ServiceAccountCredentials.from_json_keyfile_name; gspread.authorize takes it as is
+    return CachedCredentials.from_service_account_file(cred_file, scopes=scopes)
+
+# === CREDENTIAL POOL ===
+# Every key is loaded and given a token up front, then ranked by how recently it was
+# throttled, so a run starts with the least-used working keys first and a switch never
+# waits on a JWT exchange or finds out mid-run that a file is missing.
+def read_health():
+    try:
+        with open(CREDENTIAL_HEALTH_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def record_throttle(email):
+    # Remembered across runs (the state dir is cached) so the next run ranks this key lower
+    with locked_file(CREDENTIAL_HEALTH_FILE):
+        health = read_health()
+        now = time.time()
+        throttled = [t for t in health.get(email, {}).get("throttled", []) if now - t < THROTTLE_MEMORY]
+        health[email] = {"throttled": throttled + [now]}
+        tmp = CREDENTIAL_HEALTH_FILE + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(health, f)
+        os.replace(tmp, CREDENTIAL_HEALTH_FILE)
+
+def load_credential(cred_file, scopes):
+    try:
+        creds = cached_credentials(cred_file, scopes)
+        if not creds.valid:
+            creds.refresh(Request())
+        return {"file": cred_file, "email": creds.service_account_email, "creds": creds, "error": None}
+    except (OSError, ValueError, KeyError, GoogleAuthError) as e:
+        return {"file": cred_file, "email": None, "creds": None, "error": str(e)}
+
+def score_credential(entry, health, now):
+    throttled = [t for t in health.get(entry["email"], {}).get("throttled", []) if now - t < THROTTLE_MEMORY]
+    # Quota refills over a minute after a 429; keys never throttled count as full
+    since = now - max(throttled) if throttled else QUOTA_WINDOW
+    entry["recent_429s"] = len(throttled)
+    entry["quota_estimate"] = int(WRITE_QUOTA_PER_MINUTE * min(1, since / QUOTA_WINDOW))
+    return (entry["quota_estimate"], -entry["recent_429s"])
+
+def rank_credentials(cred_files, scopes):
+    with ThreadPoolExecutor(max_workers=len(cred_files)) as executor:
+        entries = list(executor.map(lambda f: load_credential(f, scopes), cred_files))
+    health, now = read_health(), time.time()
+    ready = [e for e in entries if e["creds"]]
+    ready.sort(key=lambda e: score_credential(e, health, now), reverse=True)
+    for e in entries:
+        if e["creds"] is None:
+            print(f"🚫 {e['file']}: {e['error']}")
+    print(f"🔑 {len(ready)}/{len(cred_files)} credentials ready: " +
+          ", ".join(f"{e['file']} (~{e['quota_estimate']}/min, {e['recent_429s']} recent 429s)" for e in ready))
+    return ready
+
+# === HTTP CONNECTION POOL ===
+# One adapter, and with it one keep-alive pool, mounted on every client's session whatever
+# key it authorizes with, so a credential switch reuses open TLS connections. Google only
+# gzips responses for clients whose User-Agent says "gzip".
+HTTP_POOL_SIZE = int(os.environ.get("SHEETS_HTTP_POOL_SIZE", "16"))
+USER_AGENT = "nnrg-attendance-scraper (gzip)"
+SHARED_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+
+def connection_stats():
+    # Requests sent vs. connections opened, across every host the shared pool has talked to
+    pools = [SHARED_ADAPTER.poolmanager.pools[key] for key in SHARED_ADAPTER.poolmanager.pools.keys()]
+    requests_sent = sum(pool.num_requests for pool in pools)
+    opened = sum(pool.num_connections for pool in pools)
+    return {"requests": requests_sent, "connections_opened": opened, "connections_reused": requests_sent - opened}
+
+# === QUOTA COORDINATOR ===
+# Every Sheets request first takes a slot in a sliding one-minute window kept in a
+# locked file, so processes running side by side share the quota instead of all
+# hitting 429 at once. While others are waiting, a process gets at most an equal share.
+def read_quota():
+    try:
+        with open(SHEETS_QUOTA_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def write_quota(state):
+    tmp = SHEETS_QUOTA_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, SHEETS_QUOTA_FILE)
+
+def acquire_quota(kind):
+    pid, limit = os.getpid(), QUOTA_LIMITS[kind]
+    while True:
+        with locked_file(SHEETS_QUOTA_FILE):
+            state, now = read_quota(), time.time()
+            calls = [c for c in state.get(kind, []) if now - c[0] < QUOTA_WINDOW]
+            waiting = {p: t for p, t in state.get("waiting", {}).items() if now - t < QUOTA_WINDOW}
+            mine = [t for t, p in calls if p == pid]
+            others_waiting = any(int(p) != pid for p in waiting)
+            share = max(1, limit // len({p for _, p in calls} | {int(p) for p in waiting} | {pid}))
+            if len(calls) < limit and (len(mine) < share or not others_waiting):
+                calls.append([now, pid])
+                waiting.pop(str(pid), None)
+                write_quota({**state, kind: calls, "waiting": waiting})
+                return
+            waiting[str(pid)] = now
+            write_quota({**state, kind: calls, "waiting": waiting})
+            # Until the window frees a slot overall, or frees one of our own share
+            oldest = min(t for t, _ in calls) if len(calls) >= limit else min(mine)
+        time.sleep(max(oldest + QUOTA_WINDOW - now, 0.05))
+
+# === CALL ACCOUNTING ===
+# Every Sheets request this process sends, by key, read/write and worksheet, so the end of
+# a run can show how close each key came to its per-minute quota and how many keys the
+# busiest minute actually needed.
+CALLS = []  # (time, credential email, "read" | "write", worksheets the request touched)
+CALLS_LOCK = threading.Lock()
+
+def request_worksheets(endpoint, params=None, json_body=None):
+    # Titles from A1 ranges in the URL, the params or a values:batchUpdate/batchClear body,
+    # sheet ids from spreadsheets.batchUpdate bodies
+    json_body = json_body if isinstance(json_body, dict) else {}
+    if "requests" in json_body:
+        ids = set()
+        for request in json_body["requests"]:
+            try:
+                ids.add(request_sheet_id(request))
+            except (KeyError, StopIteration, TypeError):
+                pass
+        return sorted(ids) or ["(spreadsheet)"]
+    ranges = [unquote(endpoint.split("/values/", 1)[1].split(":", 1)[0])] if "/values/" in endpoint else []
+    ranges += (params or {}).get("ranges", []) if isinstance(params, dict) else []
+    ranges += json_body.get("ranges", []) + [entry.get("range", "") for entry in json_body.get("data", [])]
+    titles = {r.rsplit("!", 1)[0].strip("'") for r in ranges if "!" in r}
+    return sorted(titles) or ["(spreadsheet)"]
+
+def account_call(email, kind, worksheets):
+    with CALLS_LOCK:
+        CALLS.append((time.time(), email, kind, tuple(worksheets)))
+
+def reset_calls():
+    with CALLS_LOCK:
+        CALLS.clear()
+
+def peak_per_minute(times):
+    # Most requests inside any sliding QUOTA_WINDOW, the way Sheets counts them
+    times, peak, first = sorted(times), 0, 0
+    for last, t in enumerate(times):
+        while t - times[first] >= QUOTA_WINDOW:
+            first += 1
+        peak = max(peak, last - first + 1)
+    return peak
+
+def call_budget(sheet_titles=None):
+    sheet_titles = sheet_titles or {}
+    with CALLS_LOCK:
+        calls = list(CALLS)
+    quotas = {"read": READ_QUOTA_PER_MINUTE, "write": WRITE_QUOTA_PER_MINUTE}
+
+    per_credential = {}
+    for email in sorted({c[1] for c in calls}):
+        entry = {}
+        for kind, quota in quotas.items():
+            times = [t for t, e, k, _ in calls if e == email and k == kind]
+            peak = peak_per_minute(times)
+            entry[kind] = {"calls": len(times), "peak_per_minute": peak, "quota_used": round(peak / quota, 2)}
+        per_credential[email] = entry
+
+    # A batchUpdate spanning several tabs counts once per key but against each tab here
+    per_worksheet = {}
+    for _, _, kind, worksheets in calls:
+        for ws in worksheets:
+            name = sheet_titles.get(ws, ws if isinstance(ws, str) else f"sheetId {ws}")
+            per_worksheet.setdefault(name, {"read": 0, "write": 0})[kind] += 1
+
+    per_minute = {}
+    for t, _, kind, _ in calls:
+        minute = datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%dT%H:%MZ")
+        per_minute.setdefault(minute, {"read": 0, "write": 0})[kind] += 1
+
+    # Keys the busiest minute would have needed to stay under every per-key quota
+    peaks = {kind: peak_per_minute([t for t, _, k, _ in calls if k == kind]) for kind in quotas}
+    return {
+        "quota_per_key": quotas,
+        "per_credential": per_credential,
+        "per_worksheet": dict(sorted(per_worksheet.items())),
+        "per_minute": dict(sorted(per_minute.items())),
+        "peak_per_minute": peaks,
+        "keys_needed": max(math.ceil(peaks[kind] / quota) for kind, quota in quotas.items()),
+    }
+
+def print_call_budget(budget):
+    print(f"📊 Sheets calls: peak {budget['peak_per_minute']['read']} reads/min, "
+          f"{budget['peak_per_minute']['write']} writes/min → {budget['keys_needed']} key(s) needed")
+    for email, entry in budget["per_credential"].items():
+        r, w = entry["read"], entry["write"]
+        print(f"   {email}: {r['calls']} reads (peak {r['peak_per_minute']}/min, {r['quota_used']:.0%} of quota), "
+              f"{w['calls']} writes (peak {w['peak_per_minute']}/min, {w['quota_used']:.0%} of quota)")
+
+class CoordinatedHTTPClient(HTTPClient):
+    def __init__(self, auth, session=None, *args, **kwargs):
+        super().__init__(auth, session, *args, **kwargs)
+        self.session.mount("https://", SHARED_ADAPTER)
+        self.session.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"})
+
+    def request(self, method, endpoint, params=None, *args, **kwargs):
+        kind = "read" if method.lower() == "get" else "write"
+        with span("quota wait"):
+            acquire_quota(kind)
+        count("scraper_sheets_requests_total", method=method.upper())
+        email = getattr(self.auth, "service_account_email", "unknown")
+        account_call(email, kind, request_worksheets(endpoint, params, kwargs.get("json")))
+        try:
+            with span(f"sheets {method.upper()}"):
+                return super().request(method, endpoint, params, *args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            if e.response.status_code == 429:
+                count("scraper_sheets_throttled_total", credential=email)
+            raise
+
+def authorize(creds):
+    # gspread.authorize, with every request going through the quota coordinator and the shared pool
+    return gspread.authorize(creds, http_client=CoordinatedHTTPClient)
+
+# === A1 HELPERS ===
+def col_letter(col):
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def col_number(letters):
+    col = 0
+    for ch in letters.upper():
+        col = col * 26 + ord(ch) - 64
+    return col
+
+def parse_a1(cell_range):
+    # "F27:F91" -> (27, 6, 91, 6), all 1-based and inclusive
+    start, _, end = cell_range.partition(":")
+    end = end or start
+    (c1, r1), (c2, r2) = [re.fullmatch(r"([A-Z]+)(\d+)", part.upper()).groups() for part in (start, end)]
+    return int(r1), col_number(c1), int(r2), col_number(c2)
+
+def grid_range(sheet_id, start_row, start_col, end_row, end_col):
+    # 1-based inclusive -> the API's 0-based half-open GridRange
+    return {
+        "sheetId": sheet_id,
+        "startRowIndex": start_row - 1, "endRowIndex": end_row,
+        "startColumnIndex": start_col - 1, "endColumnIndex": end_col,
+    }
+
+# === CELL VALUES ===
+def is_percent(value):
+    return str(value).strip().endswith("%") and to_finite(str(value).strip()[:-1]) is not None
+
+def to_finite(text):
+    try:
+        number = float(text.strip())
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+def cell_data(value):
+    # Typed values, so Sheets stores numbers without re-parsing text: "85.5 %" goes out as
+    # the fraction 0.855 (its column gets a percent format separately), plain numbers as
+    # numbers, anything else as text, and blanks clear the cell.
+    if value is None or str(value).strip() == "":
+        return {}
+    text = str(value).strip()
+    number = to_finite(text[:-1] if is_percent(text) else text)
+    if number is None:
+        # "NaN %" from a 0/0 on the portal stays text: bare NaN is not valid JSON and fails the batch
+        return {"userEnteredValue": {"stringValue": text}}
+    return {"userEnteredValue": {"numberValue": number / 100 if is_percent(text) else number}}
+
+# === REQUEST BUILDERS ===
+def insert_column_request(sheet_id, col):
+    return {"insertDimension": {
+        "range": {"sheetId": sheet_id, "dimension": "COLUMNS", "startIndex": col - 1, "endIndex": col},
+        "inheritFromBefore": False,
+    }}
+
+def append_columns_request(sheet_id, count=1):
+    return {"appendDimension": {"sheetId": sheet_id, "dimension": "COLUMNS", "length": count}}
+
+def delete_columns_request(sheet_id, first_col, last_col):
+    return {"deleteDimension": {
+        "range": {"sheetId": sheet_id, "dimension": "COLUMNS", "startIndex": first_col - 1, "endIndex": last_col},
+    }}
+
+def update_cells_request(sheet_id, start_row, start_col, rows):
+    # rows is a list of row value lists, written from (start_row, start_col) down and right
+    return {"updateCells": {
+        "start": {"sheetId": sheet_id, "rowIndex": start_row - 1, "columnIndex": start_col - 1},
+        "rows": [{"values": [cell_data(v) for v in row]} for row in rows],
+        "fields": "userEnteredValue",
+    }}
+
+def percent_format_request(sheet_id, start_row, col, end_row):
+    # One repeatCell formats a whole column span, instead of a format on every cell
+    return {"repeatCell": {
+        "range": grid_range(sheet_id, start_row, col, end_row, col),
+        "cell": {"userEnteredFormat": {"numberFormat": PERCENT_FORMAT}},
+        "fields": "userEnteredFormat.numberFormat",
+    }}
+
+def percent_format_requests(sheet_id, cells):
+    # {(row, col): value} -> one percent format per column holding percentages, over the rows written
+    spans = {}
+    for (row, col), value in cells.items():
+        if is_percent(value):
+            low, high = spans.get(col, (row, row))
+            spans[col] = (min(low, row), max(high, row))
+    return [percent_format_request(sheet_id, low, col, high) for col, (low, high) in sorted(spans.items())]
+
+def copy_paste_request(sheet_id, source, destination):
+    # source/destination are (start_row, start_col, end_row, end_col), 1-based inclusive
+    return {"copyPaste": {
+        "source": grid_range(sheet_id, *source),
+        "destination": grid_range(sheet_id, *destination),
+        "pasteType": "PASTE_NORMAL",
+    }}
+
+def clear_range_request(sheet_id, cell_range):
+    return {"updateCells": {
+        "range": grid_range(sheet_id, *parse_a1(cell_range)),
+        "fields": "userEnteredValue",
+    }}
+
+def contiguous_runs(cells):
+    # {(row, col): value} -> [(start_row, col, [values...])], one entry per unbroken run of rows
+    runs = []
+    for row, col in sorted(cells, key=lambda rc: (rc[1], rc[0])):
+        if runs and runs[-1][1] == col and runs[-1][0] + len(runs[-1][2]) == row:
+            runs[-1][2].append(cells[(row, col)])
+        else:
+            runs.append((row, col, [cells[(row, col)]]))
+    return runs
+
+def contiguous_blocks(cells):
+    # Column runs merged sideways wherever the next column covers exactly the same rows;
+    # gaps stay gaps, so a missing roll never shifts the values below it
+    blocks = []
+    for start_row, col, values in contiguous_runs(cells):
+        for block_row, block_col, rows in blocks:
+            if block_row == start_row and len(rows) == len(values) and block_col + len(rows[0]) == col:
+                for row, value in zip(rows, values):
+                    row.append(value)
+                break
+        else:
+            blocks.append((start_row, col, [[v] for v in values]))
+    return blocks
+
+# === CLASSES HELD ===
+def section_held(held_by_roll, reference_roll, section_rolls):
+    # Prefer the reference roll; if it failed, take the held column most of its section agrees on
+    if held_by_roll.get(reference_roll):
+        return held_by_roll[reference_roll]
+    counts = Counter(tuple(held_by_roll[r]) for r in section_rolls if held_by_roll.get(r))
+    if not counts:
+        return ["0"] * 13
+    print(f"⚠️ No classes held for {reference_roll}, using the section's most common values")
+    return list(counts.most_common(1)[0][0])
+
+# === WRITES ===
+def write_cells(worksheet, triples):
+    # Builds the payload straight from (row, col, value) triples: nothing is read from the
+    # sheet first, values go out typed, and the write is as few spreadsheets.batchUpdate calls
+    # as its size allows
+    cells = {(row, col): value for row, col, value in triples}
+    if not cells:
+        return 0
+    requests = [update_cells_request(worksheet.id, start_row, start_col, rows)
+                for start_row, start_col, rows in contiguous_blocks(cells)]
+    requests += percent_format_requests(worksheet.id, cells)
+    send_chunks(worksheet.spreadsheet.batch_update, chunk_requests(requests))
+    return len(requests)
+
+# === TRANSACTIONS ===
+def split_request(request, max_bytes=MAX_PAYLOAD_BYTES):
+    # An updateCells grid too big for one payload is cut into row slices that each fit
+    body = request.get("updateCells", {})
+    if "start" not in body or len(body["rows"]) < 2 or len(json.dumps(request)) <= max_bytes:
+        return [request]
+    half = len(body["rows"]) // 2
+    start = body["start"]
+    head = {"updateCells": {**body, "rows": body["rows"][:half]}}
+    tail = {"updateCells": {**body, "start": {**start, "rowIndex": start["rowIndex"] + half}, "rows": body["rows"][half:]}}
+    return split_request(head, max_bytes) + split_request(tail, max_bytes)
+
+def chunk_requests(requests, max_bytes=MAX_PAYLOAD_BYTES):
+    # Keeps request order, so structural changes still land before the writes that depend on them.
+    # Chunks come out about the same size rather than several full ones and a small tail.
+    requests = [part for request in requests for part in split_request(request, max_bytes)]
+    sizes = [len(json.dumps(request)) for request in requests]
+    if not requests:
+        return []
+    count = -(-sum(sizes) // max_bytes)
+    limit = min(max_bytes, max(-(-sum(sizes) // count), max(sizes)))
+    chunks, current, size = [], [], 0
+    for request, request_size in zip(requests, sizes):
+        if current and size + request_size > limit:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(request)
+        size += request_size
+    if current:
+        chunks.append(current)
+    return chunks
+
+def request_sheet_id(request):
+    # The worksheet a single batchUpdate request touches
+    body = next(iter(request.values()))
+    for key in ("range", "start", "source"):
+        if key in body:
+            return body[key]["sheetId"]
+    return body["sheetId"]
+
+def sheet_lanes(entries, chunk_of=lambda entry: entry):
+    # Entries whose chunks share a worksheet end up in one lane, in their original order;
+    # separate lanes touch separate sheets and can be sent concurrently
+    lanes = []
+    for entry in entries:
+        sheet_ids = {request_sheet_id(r) for r in chunk_of(entry)}
+        merged = {"sheets": sheet_ids, "entries": []}
+        for lane in [lane for lane in lanes if lane["sheets"] & sheet_ids]:
+            lanes.remove(lane)
+            merged["sheets"] |= lane["sheets"]
+            merged["entries"] += lane["entries"]
+        merged["entries"].append(entry)
+        lanes.append(merged)
+    return [lane["entries"] for lane in lanes]
+
+def error_status(e):
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None)
+
+def is_retryable(e):
+    # Throttling, server errors and dropped connections may pass; a 400 or 403 never will
+    status = error_status(e)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(e, (TransportError, Timeout, ConnectionError, TimeoutError))
+
+def column_delta(chunk):
+    # {sheet_id: columns added (or removed, negative)} by a chunk's structural requests
+    delta = {}
+    for request in chunk:
+        (kind, body), = request.items()
+        if kind in ("insertDimension", "deleteDimension") and body["range"]["dimension"] == "COLUMNS":
+            change = body["range"]["endIndex"] - body["range"]["startIndex"]
+            sheet_id = body["range"]["sheetId"]
+            delta[sheet_id] = delta.get(sheet_id, 0) + (change if kind == "insertDimension" else -change)
+        elif kind == "appendDimension" and body["dimension"] == "COLUMNS":
+            delta[body["sheetId"]] = delta.get(body["sheetId"], 0) + body["length"]
+    return {sheet_id: change for sheet_id, change in delta.items() if change}
+
+def send_lane(send, chunks, column_counts=None):
+    # A failed chunk is retried on its own; chunks already applied are never sent again.
+    # A 429 was rejected outright, but after a 5xx or a dropped connection a chunk may have
+    # landed: one that adds or removes columns is only resent once column_counts() (the
+    # sheets' current {sheet_id: column count}) shows it did not, and never without it.
+    for chunk in chunks:
+        delta = column_delta(chunk)
+        before = column_counts() if delta and column_counts else None
+        for attempt in range(1, CHUNK_RETRIES + 1):
+            try:
+                send({"requests": chunk})
+                break
+            except Exception as e:
+                if not is_retryable(e) or attempt == CHUNK_RETRIES:
+                    raise
+                if delta and error_status(e) != 429:
+                    if before is None:
+                        raise
+                    after = column_counts()
+                    if all(after.get(sheet_id, 0) - before.get(sheet_id, 0) == change for sheet_id, change in delta.items()):
+                        print(f"♻️ Chunk of {len(chunk)} requests was applied before it failed ({e}), not resending")
+                        break
+                print(f"⚠️ Chunk of {len(chunk)} requests failed ({e}), retrying it...")
+                with span("retry wait"):
+                    time.sleep(CHUNK_RETRY_WAIT * attempt)
+
+def send_chunks(send, chunks, column_counts=None):
+    lanes = sheet_lanes(chunks)
+    with ThreadPoolExecutor(max_workers=max(1, min(SEND_THREADS, len(lanes)))) as executor:
+        for future in [executor.submit(send_lane, send, lane, column_counts) for lane in lanes]:
+            future.result()
+    return len(chunks)
+
+def run_transaction(send, requests, column_counts=None):
+    # send(body) issues one spreadsheets.batchUpdate; each chunk is applied atomically by Sheets
+    chunks = chunk_requests(requests)
+    send_chunks(send, chunks, column_counts)
+    print(f"✅ Transaction applied: {len(requests)} requests in {len(chunks)} parts")
+    return len(chunks)